@@ -0,0 +1,17 @@
+# conftest.py
+from __future__ import annotations
+
+import pytest
+
+import neo_storage
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    Пустая рабочая папка: пути хранилища относительные (data/...),
+    а схема индекса создаётся один раз на путь — сбрасываем и это.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(neo_storage, "_schema_ready", set())
+    return tmp_path
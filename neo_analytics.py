@@ -0,0 +1,270 @@
+# neo_analytics.py
+"""
+Когортная аналитика по всем report.json.
+
+Отчёты один раз сворачиваются в колоночный кэш data/analytics/scores.npz
+(по строке на клиента), дальше он дополняется только изменившимися
+клиентами из индекса neo_storage. Все агрегаты считаются по кэшу numpy.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import neo_storage
+from neo_metrics import timed
+from neo_scoring import COLUMNS, POTENTIAL_IDS, ROWS, CompactReport
+
+
+ANALYTICS_DIR = os.path.join(neo_storage.DATA_DIR, "analytics")
+CACHE_PATH = os.path.join(ANALYTICS_DIR, "scores.npz")
+
+HIST_BINS = 10
+
+
+@dataclass
+class ScoreTable:
+    """
+    Колоночный кэш результатов:
+    client_ids (N,), values (N, 9, 3, 2) — pos/neg, rows (N, 3, 3) — индексы
+    потенциалов в матрице (-1 = нет), watermark — change_seq из индекса,
+    до которого кэш актуален.
+    """
+
+    client_ids: np.ndarray
+    values: np.ndarray
+    rows: np.ndarray
+    watermark: int = 0
+    # ленивые структуры для поиска похожих (см. similar); таблица неизменяемая,
+    # refresh() при изменениях создаёт новую — кэш сбрасывается сам
+    _vectors: Optional[np.ndarray] = field(default=None, repr=False, compare=False)
+    _norms: Optional[np.ndarray] = field(default=None, repr=False, compare=False)
+    _pos: Optional[Dict[str, int]] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def empty(cls) -> "ScoreTable":
+        return cls(
+            client_ids=np.array([], dtype=str),
+            values=np.zeros((0, len(POTENTIAL_IDS), len(COLUMNS), 2), dtype=np.float64),
+            rows=np.zeros((0, len(COLUMNS), len(ROWS)), dtype=np.int8),
+        )
+
+    def __len__(self) -> int:
+        return len(self.client_ids)
+
+    @property
+    def effective(self) -> np.ndarray:
+        # (N, 9, 3): плюсы минус штрафы, как by_column в report.json
+        return self.values[..., 0] - (self.values[..., 1] * 1.0)
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (N, 27) float32 профили effective и их L2-нормы (N,);
+        считаются один раз на таблицу.
+        """
+        if self._vectors is None:
+            vec = np.ascontiguousarray(self.effective.reshape(len(self), -1), dtype=np.float32)
+            self._norms = np.sqrt(np.einsum("ij,ij->i", vec, vec))
+            self._vectors = vec
+        return self._vectors, self._norms
+
+    def index_of(self, client_id: str) -> Optional[int]:
+        if self._pos is None:
+            self._pos = {cid: i for i, cid in enumerate(self.client_ids.tolist())}
+        return self._pos.get(client_id)
+
+
+_lock = threading.Lock()
+_loaded: Optional[ScoreTable] = None
+
+
+def _load(path: str = CACHE_PATH) -> ScoreTable:
+    if not os.path.exists(path):
+        return ScoreTable.empty()
+    try:
+        with np.load(path) as z:
+            return ScoreTable(
+                client_ids=z["client_ids"],
+                values=z["values"],
+                rows=z["rows"],
+                # кэш со старым watermark по updated_at (ключ "watermark")
+                # сюда не проходит и строится заново
+                watermark=int(z["change_seq"]),
+            )
+    except Exception:
+        # битый кэш просто строим заново
+        return ScoreTable.empty()
+
+
+def _save(table: ScoreTable, path: str = CACHE_PATH):
+    dirname = os.path.dirname(path) or "."
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".npz", dir=dirname)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                client_ids=table.client_ids,
+                values=table.values,
+                rows=table.rows,
+                change_seq=np.int64(table.watermark),
+            )
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+@timed("analytics.refresh")
+def refresh() -> ScoreTable:
+    """
+    Дочитывает в кэш только отчёты, изменившиеся после watermark,
+    и возвращает актуальную таблицу (она же остаётся в памяти процесса).
+    """
+    global _loaded
+    with _lock:
+        table = _loaded if _loaded is not None else _load()
+
+        changed = neo_storage.changed_since(table.watermark)
+        if not changed:
+            _loaded = table
+            return table
+
+        pos_by_id = {cid: i for i, cid in enumerate(table.client_ids.tolist())}
+        values = [table.values]
+        rows = [table.rows]
+        new_ids = []
+        upd_idx, upd_values, upd_rows = [], [], []
+
+        for cid, _ in changed:
+            report = neo_storage.safe_read_json(os.path.join(neo_storage.client_dir(cid), "report.json"))
+            if not isinstance(report, dict):
+                continue
+            compact = CompactReport.from_report(report)
+            if cid in pos_by_id:
+                upd_idx.append(pos_by_id[cid])
+                upd_values.append(compact.values)
+                upd_rows.append(compact.rows)
+            else:
+                pos_by_id[cid] = len(table.client_ids) + len(new_ids)
+                new_ids.append(cid)
+                values.append(compact.values[None])
+                rows.append(compact.rows[None])
+
+        merged = ScoreTable(
+            client_ids=np.concatenate([table.client_ids, np.array(new_ids, dtype=str)]) if new_ids else table.client_ids,
+            values=np.concatenate(values) if len(values) > 1 else table.values.copy(),
+            rows=np.concatenate(rows) if len(rows) > 1 else table.rows.copy(),
+            watermark=max(seq for _, seq in changed),
+        )
+        if upd_idx:
+            merged.values[upd_idx] = np.stack(upd_values)
+            merged.rows[upd_idx] = np.stack(upd_rows)
+
+        _save(merged)
+        _loaded = merged
+        return merged
+
+
+def rebuild() -> ScoreTable:
+    """
+    Полная перестройка кэша (например, после переиндексации).
+    """
+    global _loaded
+    with _lock:
+        _loaded = ScoreTable.empty()
+        try:
+            os.unlink(CACHE_PATH)
+        except FileNotFoundError:
+            pass
+    return refresh()
+
+
+# =========================
+#  Агрегаты
+# =========================
+def row_distribution(table: ScoreTable) -> np.ndarray:
+    """
+    (3 columns, 3 rows, 9 potentials): сколько клиентов получили
+    потенциал в данном ряду данной колонки.
+    """
+    n_p = len(POTENTIAL_IDS)
+    out = np.zeros((len(COLUMNS), len(ROWS), n_p), dtype=np.int64)
+    for ci in range(len(COLUMNS)):
+        for ri in range(len(ROWS)):
+            idx = table.rows[:, ci, ri]
+            out[ci, ri] = np.bincount(idx[idx >= 0], minlength=n_p)
+    return out
+
+
+def strength_histograms(table: ScoreTable, bins: int = HIST_BINS) -> Dict[str, Any]:
+    """
+    Гистограммы силы потенциала (strength = сумма effective по колонкам)
+    с общими для всех потенциалов границами корзин.
+    """
+    strength = table.effective.sum(axis=2)  # (N, 9)
+    if strength.size == 0:
+        edges = np.linspace(0.0, 1.0, bins + 1)
+    else:
+        lo, hi = float(strength.min()), float(strength.max())
+        edges = np.linspace(lo, hi if hi > lo else lo + 1.0, bins + 1)
+    counts = np.stack([np.histogram(strength[:, pi], bins=edges)[0] for pi in range(len(POTENTIAL_IDS))])
+    return {"edges": edges, "counts": counts}
+
+
+def cooccurrence(table: ScoreTable, rows_used=("row1", "row2")) -> np.ndarray:
+    """
+    (9, 9): у скольких клиентов оба потенциала встречаются среди рядов
+    rows_used (в любой колонке). Диагональ — сколько клиентов с потенциалом.
+    """
+    n_p = len(POTENTIAL_IDS)
+    member = np.zeros((len(table), n_p), dtype=np.int64)
+    for ri, row in enumerate(ROWS):
+        if row not in rows_used:
+            continue
+        for ci in range(len(COLUMNS)):
+            idx = table.rows[:, ci, ri].astype(np.int64)
+            ok = idx >= 0
+            member[np.nonzero(ok)[0], idx[ok]] = 1
+    return member.T @ member
+
+
+def similar(table: ScoreTable, client_id: str, k: int = 10, metric: str = "cosine") -> List[Tuple[str, float]]:
+    """
+    k ближайших к client_id клиентов по 27-мерному профилю effective
+    (9 потенциалов × 3 колонки): [(client_id, score)], лучшие первыми.
+    metric="cosine" — похожесть формы профиля (score = косинус, больше — ближе),
+    metric="euclidean" — абсолютная разница баллов (score = расстояние).
+    Полный перебор одной матричной операцией: на 100k клиентов — миллисекунды.
+    """
+    qi = table.index_of(client_id)
+    if qi is None or len(table) < 2:
+        return []
+    vec, norms = table.vectors()
+    dots = vec @ vec[qi]
+
+    if metric == "euclidean":
+        # |a-b|² = |a|² + |b|² - 2ab
+        score = np.sqrt(np.maximum(norms * norms + norms[qi] * norms[qi] - 2.0 * dots, 0.0))
+        order_key = score
+    else:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            score = np.where(norms * norms[qi] > 0, dots / (norms * norms[qi]), 0.0)
+        order_key = -score
+
+    order_key = order_key.copy()
+    order_key[qi] = np.inf  # самого клиента не возвращаем
+    k = max(0, min(int(k), len(table) - 1))
+    if k == 0:
+        return []
+    top = np.argpartition(order_key, k - 1)[:k]
+    top = top[np.argsort(order_key[top], kind="stable")]
+    return [(str(table.client_ids[i]), float(score[i])) for i in top]
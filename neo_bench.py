@@ -0,0 +1,331 @@
+# neo_bench.py
+"""
+Бенчмарк скоринга на синтетических респондентах.
+
+    python neo_bench.py                          # 1, 10k, 1M респондентов
+    python neo_bench.py -n 1000 -n 50000 --mode scalar
+    python neo_bench.py --json bench.json        # сохранить результат
+    python neo_bench.py --baseline bench.json    # упасть, если стало медленнее
+    python neo_bench.py --memory                 # ещё и пиковая память (отдельный прогон)
+    python neo_bench.py --check                  # скалярный и пакетный скоринг совпадают
+
+Генератор выдаёт ответы во всех формах, которые понимает
+_extract_all_selected: строка с id, opt_N, opt_<id>, списки,
+{"selected": [...]} и {"fast": [...], "slow": [...]}, плюс текстовые поля.
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import random
+import sys
+import time
+import tracemalloc
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional
+
+from neo_questionnaire import BLOCKS_PATH, load_questionnaire
+from neo_scoring import (
+    POTENTIAL_IDS,
+    CompiledQuestionnaire,
+    IncrementalScorer,
+    _all_questions,
+    compile_questionnaire,
+    encode_answers,
+    iter_score_many,
+    score_blocks,
+    score_counts,
+    score_many,
+    score_sparse,
+    SparseCounts,
+)
+
+
+DEFAULT_SIZES = (1, 10_000, 1_000_000)
+CHUNK_SIZE = 4096
+# память меряется отдельным прогоном под tracemalloc, он в разы медленнее;
+# скоринг потоковый, поэтому пик на 10k тот же, что и на 1M
+MEMORY_MAX_N = 10_000
+
+
+def _options(question: Dict[str, Any]) -> List[str]:
+    return [
+        str(o.get("potential")).strip().lower()
+        for o in (question.get("options") or [])
+        if isinstance(o, dict) and o.get("potential")
+    ]
+
+
+def _one_answer(rnd: random.Random, question: Dict[str, Any]) -> Any:
+    opts = _options(question)
+    if not opts:
+        return rnd.choice(POTENTIAL_IDS)
+
+    i = rnd.randrange(len(opts))
+    pid = opts[i]
+    shape = rnd.randrange(7)
+    if shape == 0:
+        return pid  # "citrine"
+    if shape == 1:
+        return f"opt_{i + 1}"  # "opt_3" — старый формат без id
+    if shape == 2:
+        return f"opt_{pid}"  # "opt_citrine"
+    if shape == 3:
+        return [f"opt_{i + 1}", rnd.choice(opts)]  # ["opt_1","amber"]
+    if shape == 4:
+        return {"selected": [pid]}  # как пишет визард
+    if shape == 5:
+        return {"fast": [f"opt_{pid}", rnd.choice(opts)], "slow": [f"opt_{rnd.choice(opts)}"]}
+    return {"selected": [pid], "note": "комментарий"}
+
+
+def synthetic_answers(
+    compiled: CompiledQuestionnaire,
+    n: int,
+    seed: int = 42,
+    skip_rate: float = 0.05,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Потоково генерирует n payload'ов формата responses.json.
+    skip_rate — доля пропущенных вопросов.
+    """
+    rnd = random.Random(seed)
+    questions = [q for q in compiled.questions if q.get("id") in compiled.item_index]
+    for i in range(n):
+        answers: Dict[str, Any] = {}
+        for q in questions:
+            if rnd.random() < skip_rate:
+                continue
+            answers[q["id"]] = _one_answer(rnd, q)
+        # текстовые поля скоринг должен игнорировать
+        answers[f"{questions[0]['id']}_text"] = "Меня затягивает, когда выстраиваю структуру"
+        yield {"respondent_id": f"synthetic-{i}", "answers": answers}
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def bench_scalar(compiled: CompiledQuestionnaire, n: int, seed: int = 42) -> Dict[str, Any]:
+    """
+    score_blocks по одному: задержка на отчёт.
+    Время генерации ответов в замер не входит.
+    """
+    latencies: List[float] = []
+    total = 0.0
+    for payload in synthetic_answers(compiled, n, seed=seed):
+        t0 = time.perf_counter()
+        score_blocks(compiled, payload)
+        dt = time.perf_counter() - t0
+        latencies.append(dt)
+        total += dt
+    latencies.sort()
+    return {
+        "mode": "scalar",
+        "n": n,
+        "seconds": total,
+        "throughput": n / total if total else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1e3,
+        "p99_ms": _percentile(latencies, 99) * 1e3,
+    }
+
+
+def bench_batch(compiled: CompiledQuestionnaire, n: int, seed: int = 42, chunk_size: int = CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    iter_score_many пачками по chunk_size. Перцентили — по времени
+    пачки целиком (p50_chunk_ms/p99_chunk_ms): отдельного отчёта
+    пакетный путь не выдаёт раньше, чем посчитана вся пачка.
+    """
+    per_chunk: List[float] = []
+    total = 0.0
+    it = synthetic_answers(compiled, n, seed=seed)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            break
+        t0 = time.perf_counter()
+        for _ in iter_score_many(compiled, chunk, chunk_size=chunk_size):
+            pass
+        dt = time.perf_counter() - t0
+        total += dt
+        per_chunk.append(dt)
+    per_chunk.sort()
+    return {
+        "mode": "batch",
+        "n": n,
+        "seconds": total,
+        "throughput": n / total if total else 0.0,
+        "chunk_size": chunk_size,
+        "p50_chunk_ms": _percentile(per_chunk, 50) * 1e3,
+        "p99_chunk_ms": _percentile(per_chunk, 99) * 1e3,
+    }
+
+
+def _latency_text(res: Dict[str, Any]) -> str:
+    if "p50_chunk_ms" in res:
+        return f"пачка({res['chunk_size']}) p50={res['p50_chunk_ms']:.3f}мс  p99={res['p99_chunk_ms']:.3f}мс"
+    return f"отчёт p50={res['p50_ms']:.3f}мс  p99={res['p99_ms']:.3f}мс"
+
+
+def peak_memory(fn, compiled: CompiledQuestionnaire, n: int, seed: int = 42) -> float:
+    """
+    Пиковая память прогона fn в МБ (tracemalloc).
+    """
+    tracemalloc.start()
+    try:
+        fn(compiled, n, seed=seed)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def run(
+    sizes=DEFAULT_SIZES,
+    modes=("scalar", "batch"),
+    blocks_path: str = BLOCKS_PATH,
+    measure_memory: bool = False,
+    seed: int = 42,
+    out=sys.stderr,
+) -> List[Dict[str, Any]]:
+    compiled = load_questionnaire(blocks_path).compiled
+    results = []
+    for n in sizes:
+        for mode in modes:
+            fn = bench_scalar if mode == "scalar" else bench_batch
+            res = fn(compiled, n, seed=seed)
+            line = f"{mode:>6} n={n:<9} {res['throughput']:>10.0f} отч/с  {_latency_text(res)}"
+            if measure_memory:
+                # отдельный прогон: tracemalloc не искажает скорость выше
+                res["peak_mem_n"] = min(n, MEMORY_MAX_N)
+                res["peak_mem_mb"] = peak_memory(fn, compiled, res["peak_mem_n"], seed=seed)
+                line += f"  peak={res['peak_mem_mb']:.1f}МБ (n={res['peak_mem_n']})"
+            results.append(res)
+            print(line, file=out, flush=True)
+    return results
+
+
+# веса, которые не представимы точно в двоичном виде: на них видно,
+# если скалярный и пакетный пути складывают баллы по-разному
+ODD_WEIGHTS = (0.1, 0.3, 1 / 3, 0.7, 1.1)
+
+
+def _odd_blocks(blocks: Dict[str, Any], rnd: random.Random) -> Dict[str, Any]:
+    # копия опросника с «неудобными» весами и частью штрафных вопросов
+    out = copy.deepcopy(blocks)
+    for q in _all_questions(out):
+        q["weight"] = rnd.choice(ODD_WEIGHTS)
+        if rnd.random() < 0.2:
+            q["invert_score"] = True
+            q["invert_multiplier"] = rnd.choice(ODD_WEIGHTS)
+    return out
+
+
+def _with_repeats(payload: Dict[str, Any], rnd: random.Random) -> Dict[str, Any]:
+    # один и тот же потенциал несколько раз в одном ответе
+    answers = dict(payload["answers"])
+    for qid, ans in list(answers.items()):
+        if qid.endswith("_text") or rnd.random() >= 0.3:
+            continue
+        answers[qid] = [ans] * rnd.randint(2, 4)
+    return {**payload, "answers": answers}
+
+
+def check(blocks: Dict[str, Any], n: int = 2000, seed: int = 42) -> List[str]:
+    """
+    Сверяет все пути скоринга на синтетике с нецелыми весами и повторами
+    токенов: score_many, IncrementalScorer и score_sparse должны давать
+    ровно то же, что score_blocks. Возвращает описания расхождений.
+    """
+    rnd = random.Random(seed)
+    compiled = compile_questionnaire(_odd_blocks(blocks, rnd))
+    payloads = [_with_repeats(p, rnd) for p in synthetic_answers(compiled, n, seed=seed)]
+
+    problems: List[str] = []
+    expected = [score_blocks(compiled, p) for p in payloads]
+    for i, (got, exp) in enumerate(zip(score_many(compiled, payloads), expected)):
+        if got != exp:
+            problems.append(f"score_many != score_blocks у респондента {i}")
+
+    for i, (p, exp) in enumerate(zip(payloads, expected)):
+        scorer = IncrementalScorer(compiled)
+        for qid, ans in p["answers"].items():
+            scorer.set_answer(qid, ans)
+        if scorer.report() != exp:
+            problems.append(f"IncrementalScorer != score_blocks у респондента {i}")
+
+    counts = encode_answers(compiled, payloads)
+    dense = score_counts(compiled, counts)
+    sparse = score_sparse(compiled, SparseCounts.from_counts(counts))
+    if not all((a == b).all() for a, b in zip(dense, sparse)):
+        problems.append("score_sparse != score_counts")
+    return problems
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """
+    Регрессии пропускной способности относительно baseline (доля tolerance).
+    """
+    base = {(r["mode"], r["n"]): r for r in baseline}
+    problems = []
+    for r in results:
+        b = base.get((r["mode"], r["n"]))
+        if not b or not b.get("throughput"):
+            continue
+        if r["throughput"] < b["throughput"] * (1.0 - tolerance):
+            problems.append(
+                f"{r['mode']} n={r['n']}: {r['throughput']:.0f} отч/с против {b['throughput']:.0f} в baseline"
+            )
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк скоринга NEO")
+    parser.add_argument("-n", "--size", type=int, action="append", help="число респондентов (можно несколько раз)")
+    parser.add_argument("--mode", choices=["scalar", "batch", "all"], default="all")
+    parser.add_argument("--blocks", default=BLOCKS_PATH)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--memory", action="store_true", help=f"мерить пиковую память (tracemalloc, n до {MEMORY_MAX_N})"
+    )
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое падение пропускной способности")
+    parser.add_argument("--check", action="store_true", help="только сверить пути скоринга между собой")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        problems = check(load_questionnaire(args.blocks).blocks, n=args.size[0] if args.size else 2000, seed=args.seed)
+        for p in problems[:20]:
+            print(f"[расхождение] {p}", file=sys.stderr)
+        print(f"Расхождений: {len(problems)}", file=sys.stderr)
+        return 1 if problems else 0
+
+    modes = ("scalar", "batch") if args.mode == "all" else (args.mode,)
+    results = run(
+        sizes=args.size or DEFAULT_SIZES,
+        modes=modes,
+        blocks_path=args.blocks,
+        measure_memory=args.memory,
+        seed=args.seed,
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for p in problems:
+            print(f"[регрессия] {p}", file=sys.stderr)
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
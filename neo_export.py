@@ -0,0 +1,206 @@
+# neo_export.py
+"""
+Колоночная выгрузка результатов для офлайн-анализа.
+
+    python neo_export.py                  # дописать новых клиентов
+    python neo_export.py --full           # выгрузить всё заново
+    python neo_export.py --format npz     # без pyarrow
+
+Одна строка на клиента, фиксированные колонки
+<potential>.<column>.<pos|neg|eff> и <column>.<row>. Данные пишутся
+частями data/export/part-NNNNNN.(parquet|npz); следующая выгрузка
+продолжает с водяного знака (created_at, client_id) из _watermark.json.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import neo_storage
+from neo_scoring import COLUMNS, POTENTIAL_IDS, ROWS, CompactReport
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:  # pyarrow — необязательная зависимость
+    pa = None
+    pq = None
+
+
+EXPORT_DIR = os.path.join(neo_storage.DATA_DIR, "export")
+WATERMARK_NAME = "_watermark.json"
+
+# незавершённые сессии моложе суток держат водяной знак: их отчёт ещё появится
+STALE_SESSION_SECONDS = 24 * 3600
+
+KINDS = ("pos", "neg", "eff")
+
+SCORE_COLUMNS = [f"{pid}.{col}.{kind}" for pid in POTENTIAL_IDS for col in COLUMNS for kind in KINDS]
+MATRIX_COLUMNS = [f"{col}.{row}" for col in COLUMNS for row in ROWS]
+
+
+def _default_format() -> str:
+    return "parquet" if pq is not None else "npz"
+
+
+def _read_watermark(out_dir: str) -> Dict[str, Any]:
+    wm = neo_storage.safe_read_json(os.path.join(out_dir, WATERMARK_NAME))
+    if not isinstance(wm, dict):
+        wm = {}
+    return {
+        "created_at": int(wm.get("created_at") or 0),
+        "client_id": str(wm.get("client_id") or ""),
+        "parts": int(wm.get("parts") or 0),
+        "format": wm.get("format"),
+    }
+
+
+def _columns(batch: List[Dict[str, Any]], reports: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    n = len(batch)
+    scores = np.zeros((n, len(POTENTIAL_IDS), len(COLUMNS), len(KINDS)), dtype=np.float64)
+    matrix = np.full((n, len(COLUMNS), len(ROWS)), "", dtype=object)
+    versions = []
+
+    for i, report in enumerate(reports):
+        compact = CompactReport.from_report(report)
+        scores[i, :, :, 0] = compact.values[..., 0]
+        scores[i, :, :, 1] = compact.values[..., 1]
+        scores[i, :, :, 2] = compact.values[..., 0] - (compact.values[..., 1] * 1.0)
+        for ci in range(len(COLUMNS)):
+            for ri in range(len(ROWS)):
+                idx = int(compact.rows[ci, ri])
+                matrix[i, ci, ri] = POTENTIAL_IDS[idx] if idx >= 0 else ""
+        meta = report.get("meta") if isinstance(report.get("meta"), dict) else {}
+        versions.append(str(meta.get("questionnaire_version") or ""))
+
+    cols: Dict[str, np.ndarray] = {
+        "client_id": np.array([c["client_id"] for c in batch], dtype=object),
+        "created_at": np.array([int(c["created_at"]) for c in batch], dtype=np.int64),
+        "questionnaire_version": np.array(versions, dtype=object),
+    }
+    flat_scores = scores.reshape(n, -1)
+    for j, name in enumerate(SCORE_COLUMNS):
+        cols[name] = flat_scores[:, j]
+    flat_matrix = matrix.reshape(n, -1)
+    for j, name in enumerate(MATRIX_COLUMNS):
+        cols[name] = flat_matrix[:, j]
+    return cols
+
+
+def _write_part(path: str, cols: Dict[str, np.ndarray], fmt: str):
+    dirname = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=dirname)
+    os.close(fd)
+    try:
+        if fmt == "parquet":
+            pq.write_table(pa.table({k: v.tolist() if v.dtype == object else v for k, v in cols.items()}), tmp)
+        else:
+            with open(tmp, "wb") as f:
+                np.savez(f, **{k: v.astype(str) if v.dtype == object else v for k, v in cols.items()})
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def export(
+    out_dir: str = EXPORT_DIR,
+    fmt: Optional[str] = None,
+    full: bool = False,
+    chunk_size: int = 10000,
+    progress=sys.stderr,
+) -> int:
+    """
+    Дописывает в out_dir клиентов после водяного знака. Возвращает,
+    сколько строк выгружено. Память — не больше одной части (chunk_size).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    wm = _read_watermark(out_dir)
+
+    if full or (fmt and wm["format"] and fmt != wm["format"]):
+        # новый формат или полная выгрузка — старые части убираем
+        for p in glob.glob(os.path.join(out_dir, "part-*")):
+            os.unlink(p)
+        wm = {"created_at": 0, "client_id": "", "parts": 0, "format": None}
+
+    fmt = fmt or wm["format"] or _default_format()
+    if fmt == "parquet" and pq is None:
+        raise RuntimeError("Для Parquet нужен pyarrow (pip install pyarrow) — или используйте --format npz")
+
+    # не уходим дальше самой ранней незавершённой (свежей) сессии
+    floor = neo_storage.oldest_unfinished(int(time.time()) - STALE_SESSION_SECONDS)
+
+    exported = 0
+    while True:
+        batch = neo_storage.clients_created_after(wm["created_at"], wm["client_id"], limit=chunk_size)
+        if floor is not None:
+            batch = [c for c in batch if int(c["created_at"]) < floor]
+        if not batch:
+            break
+
+        reports = []
+        rows = []
+        for c in batch:
+            report = neo_storage.safe_read_json(os.path.join(neo_storage.client_dir(c["client_id"]), "report.json"))
+            if isinstance(report, dict):
+                rows.append(c)
+                reports.append(report)
+
+        if rows:
+            part = os.path.join(out_dir, f"part-{wm['parts']:06d}.{fmt}")
+            _write_part(part, _columns(rows, reports), fmt)
+            wm["parts"] += 1
+            exported += len(rows)
+
+        last = batch[-1]
+        wm.update(created_at=int(last["created_at"]), client_id=last["client_id"], format=fmt)
+        neo_storage.save_json(os.path.join(out_dir, WATERMARK_NAME), wm)
+        print(f"\rвыгружено {exported}", end="", file=progress, flush=True)
+
+    print("", file=progress)
+    return exported
+
+
+def read_export(out_dir: str = EXPORT_DIR) -> Dict[str, np.ndarray]:
+    """
+    Собирает все части выгрузки в словарь колонок (numpy-массивы).
+    """
+    parts = sorted(glob.glob(os.path.join(out_dir, "part-*")))
+    chunks: List[Dict[str, np.ndarray]] = []
+    for p in parts:
+        if p.endswith(".parquet"):
+            table = pq.read_table(p)
+            chunks.append({name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names})
+        elif p.endswith(".npz"):
+            with np.load(p) as z:
+                chunks.append({k: z[k] for k in z.files})
+    if not chunks:
+        return {}
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Колоночная выгрузка результатов клиентов")
+    parser.add_argument("--out", default=EXPORT_DIR, help="папка выгрузки")
+    parser.add_argument("--format", choices=["parquet", "npz"], default=None, help="по умолчанию parquet, если есть pyarrow")
+    parser.add_argument("--full", action="store_true", help="выгрузить всё заново")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="строк в одной части")
+    args = parser.parse_args(argv)
+
+    n = export(out_dir=args.out, fmt=args.format, full=args.full, chunk_size=args.chunk_size)
+    print(f"Готово: {n} строк -> {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+# neo_import.py
+"""
+Потоковый импорт ответов партнёров.
+
+    python neo_import.py answers.jsonl
+    python neo_import.py answers.csv --errors bad.jsonl
+    python neo_import.py answers.jsonl --dry-run       # только проверить
+
+JSONL: одна запись на строку —
+    {"respondent_id": "...", "name": "...", "phone": "...", "answers": {...}}
+CSV: колонки respondent_id/client_id/name/phone/created_at и либо колонка
+answers (JSON), либо по колонке на вопрос (несколько вариантов через | или ;).
+
+Файл читается генератором, валидные записи копятся пачкой, пачка
+считается batch-скорингом и пишется в папки клиентов + индекс одной
+транзакцией. Память — одна пачка. Битая строка попадает в отчёт об
+ошибках и не останавливает импорт.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import neo_storage
+from neo_questionnaire import BLOCKS_PATH, Questionnaire, load_questionnaire
+from neo_scoring import _extract_all_selected, iter_score_many
+
+
+BATCH_SIZE = 1000
+
+META_FIELDS = ("client_id", "respondent_id", "name", "phone", "created_at", "answers")
+
+
+class RecordError(ValueError):
+    """Запись не прошла проверку; текст — причина для отчёта."""
+
+
+# =========================
+#  Чтение
+# =========================
+_BOM = b"\xef\xbb\xbf"
+
+
+def _bad_utf8(e: UnicodeDecodeError) -> RecordError:
+    return RecordError(f"не UTF-8: байт 0x{e.object[e.start]:02x} в позиции {e.start}")
+
+
+def _iter_jsonl(f: BinaryIO) -> Iterator[Tuple[int, Any]]:
+    # строки декодируем по одной: битый байт портит только свою запись
+    for lineno, raw in enumerate(f, start=1):
+        if lineno == 1 and raw.startswith(_BOM):
+            raw = raw[len(_BOM):]
+        try:
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            yield lineno, json.loads(line)
+        except UnicodeDecodeError as e:
+            yield lineno, _bad_utf8(e)
+        except json.JSONDecodeError as e:
+            yield lineno, RecordError(f"битый JSON: {e.msg}")
+
+
+def _split_cell(value: str) -> Any:
+    parts = [p.strip() for p in value.replace(";", "|").split("|") if p.strip()]
+    return parts[0] if len(parts) == 1 else parts
+
+
+def _csv_lines(f: BinaryIO, pos: List[int]) -> Iterator[str]:
+    # surrogateescape держит границы строк и полей, битые байты
+    # всплывают как суррогаты и отсеиваются по строке в _iter_csv;
+    # pos[0] — номер последней отданной строки (csv.Error не двигает line_num)
+    for lineno, raw in enumerate(f, start=1):
+        pos[0] = lineno
+        if lineno == 1 and raw.startswith(_BOM):
+            raw = raw[len(_BOM):]
+        yield raw.decode("utf-8", "surrogateescape")
+
+
+def _not_utf8_column(row: Dict[Optional[str], Any]) -> Optional[str]:
+    # лишние поля строки DictReader кладёт списком под ключ None
+    for k, v in row.items():
+        for s in [k] + (v if isinstance(v, list) else [v]):
+            if not isinstance(s, str):
+                continue
+            try:
+                s.encode("utf-8")
+            except UnicodeEncodeError:
+                return k or "—"
+    return None
+
+
+def _iter_csv(f: BinaryIO) -> Iterator[Tuple[int, Any]]:
+    pos = [0]
+    reader = csv.DictReader(_csv_lines(f, pos))
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield pos[0], RecordError(f"битая строка CSV: {e}")
+            continue
+        lineno = pos[0]
+        column = _not_utf8_column(row)
+        if column is not None:
+            yield lineno, RecordError(f"не UTF-8 в колонке {column!r}")
+            continue
+        record: Dict[str, Any] = {k: (v or "").strip() for k, v in row.items() if k in META_FIELDS and k != "answers"}
+        if (row.get("answers") or "").strip():
+            try:
+                record["answers"] = json.loads(row["answers"])
+            except json.JSONDecodeError as e:
+                yield lineno, RecordError(f"битый JSON в колонке answers: {e.msg}")
+                continue
+        else:
+            record["answers"] = {
+                k: _split_cell(v)
+                for k, v in row.items()
+                if k and k not in META_FIELDS and (v or "").strip()
+            }
+        yield lineno, record
+
+
+def iter_records(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, Any]]:
+    """
+    (номер строки, запись | RecordError) по одной, не читая файл целиком.
+    """
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, "rb") as f:
+        yield from (_iter_csv(f) if fmt == "csv" else _iter_jsonl(f))
+
+
+# =========================
+#  Проверка
+# =========================
+def validate(record: Any, questionnaire: Questionnaire, now: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Проверяет запись по опроснику и возвращает (profile, responses).
+    Бросает RecordError с причиной.
+    """
+    if not isinstance(record, dict):
+        raise RecordError("запись должна быть JSON-объектом")
+
+    respondent = record.get("respondent") if isinstance(record.get("respondent"), dict) else {}
+    rid = str(record.get("client_id") or record.get("respondent_id") or respondent.get("client_id") or "").strip()
+    if not rid:
+        raise RecordError("нет respondent_id / client_id")
+
+    answers = record.get("answers") or record.get("responses")
+    if not isinstance(answers, dict) or not answers:
+        raise RecordError("нет ответов (answers)")
+
+    compiled = questionnaire.compiled
+    known = {str(q.get("id")): q for q in compiled.questions}
+    for qid, raw in answers.items():
+        qid = str(qid)
+        if qid.endswith("_text") and qid[: -len("_text")] in known:
+            continue
+        q = known.get(qid)
+        if q is None:
+            raise RecordError(f"неизвестный вопрос {qid!r}")
+        if qid not in compiled.item_index:
+            continue  # текстовый/нескоринговый вопрос
+        # свободный текст (note/text/comment) _extract_all_selected пропускает сам
+        for token in _extract_all_selected(raw):
+            if compiled.resolve(qid, token) is None:
+                raise RecordError(f"вопрос {qid}: не распознан вариант {token!r}")
+
+    try:
+        created_at = int(record.get("created_at") or respondent.get("created_at") or now or time.time())
+    except (TypeError, ValueError):
+        raise RecordError(f"created_at не число: {record.get('created_at')!r}")
+
+    client_id = neo_storage.slugify(rid)
+    if not record.get("client_id"):
+        client_id = f"import-{client_id}"
+
+    profile = {
+        "client_id": client_id,
+        "name": str(record.get("name") or respondent.get("name") or rid).strip(),
+        "phone": str(record.get("phone") or respondent.get("phone") or "").strip(),
+        "created_at": created_at,
+        "source": "import",
+    }
+    responses = {"respondent": profile, "respondent_id": rid, "answers": answers}
+    return profile, responses
+
+
+# =========================
+#  Импорт
+# =========================
+def _write_batch(batch: List[Tuple[Dict[str, Any], Dict[str, Any]]], questionnaire: Questionnaire):
+    profiles = []
+    reports = iter_score_many(questionnaire.compiled, [responses for _, responses in batch], chunk_size=len(batch))
+    for (profile, responses), report in zip(batch, reports):
+        cdir = neo_storage.client_dir(profile["client_id"])
+        os.makedirs(cdir, exist_ok=True)
+        neo_storage.save_json(os.path.join(cdir, "profile.json"), profile)
+        neo_storage.save_json(os.path.join(cdir, "responses.json"), responses)
+        report = neo_storage.stamp_report(report, questionnaire, responses)
+        neo_storage.save_json(os.path.join(cdir, "report.json"), report, compact=True)
+        profiles.append(profile)
+    neo_storage.upsert_clients(profiles, report_status=neo_storage.REPORT_DONE)
+
+
+def run(
+    path: str,
+    fmt: Optional[str] = None,
+    blocks_path: str = BLOCKS_PATH,
+    batch_size: int = BATCH_SIZE,
+    dry_run: bool = False,
+    overwrite: bool = False,
+    errors: Optional[TextIO] = None,
+    progress: TextIO = sys.stderr,
+) -> Dict[str, int]:
+    """
+    Импортирует файл и возвращает счётчики:
+    imported, skipped (клиент уже есть), errors.
+    """
+    questionnaire = load_questionnaire(blocks_path)
+    stats = {"imported": 0, "skipped": 0, "errors": 0}
+    batch: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    seen_in_batch = set()
+
+    def report_error(lineno: int, reason: str):
+        stats["errors"] += 1
+        print(f"строка {lineno}: {reason}", file=progress)
+        if errors is not None:
+            errors.write(json.dumps({"line": lineno, "error": reason}, ensure_ascii=False) + "\n")
+
+    def flush():
+        if batch and dry_run:
+            for _ in iter_score_many(questionnaire.compiled, [r for _, r in batch], chunk_size=len(batch)):
+                pass
+        elif batch:
+            _write_batch(batch, questionnaire)
+        stats["imported"] += len(batch)
+        batch.clear()
+        seen_in_batch.clear()
+        print(f"\rимпортировано {stats['imported']}", end="", file=progress, flush=True)
+
+    for lineno, record in iter_records(path, fmt):
+        if isinstance(record, RecordError):
+            report_error(lineno, str(record))
+            continue
+        try:
+            profile, responses = validate(record, questionnaire)
+        except RecordError as e:
+            report_error(lineno, str(e))
+            continue
+
+        cid = profile["client_id"]
+        if cid in seen_in_batch or (
+            not overwrite and os.path.exists(os.path.join(neo_storage.client_dir(cid), "responses.json"))
+        ):
+            stats["skipped"] += 1
+            continue
+
+        seen_in_batch.add(cid)
+        batch.append((profile, responses))
+        if len(batch) >= batch_size:
+            flush()
+
+    flush()
+    print("", file=progress)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Импорт ответов из JSONL/CSV")
+    parser.add_argument("path", help="файл .jsonl или .csv")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="по умолчанию — по расширению")
+    parser.add_argument("--blocks", default=BLOCKS_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="проверить и посчитать, ничего не записывая")
+    parser.add_argument("--overwrite", action="store_true", help="перезаписать уже импортированных клиентов")
+    parser.add_argument("--errors", help="записать ошибки в JSONL-файл")
+    args = parser.parse_args(argv)
+
+    errors = open(args.errors, "w", encoding="utf-8") if args.errors else None
+    try:
+        stats = run(
+            args.path,
+            fmt=args.format,
+            blocks_path=args.blocks,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            overwrite=args.overwrite,
+            errors=errors,
+        )
+    finally:
+        if errors is not None:
+            errors.close()
+
+    print(f"Готово: импортировано {stats['imported']}, пропущено {stats['skipped']}, ошибок {stats['errors']}")
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
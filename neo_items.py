@@ -0,0 +1,188 @@
+# neo_items.py
+"""
+Статистика по вопросам neo_blocks.json (item analysis).
+
+    python neo_items.py
+
+По всем responses.json считает для каждого вопроса:
+- частоты выбора вариантов (доля ответивших);
+- дискриминацию варианта: корреляция «выбрал потенциал p в вопросе»
+  с «p стоит в row1 этой колонки» по текущему скорингу; у штрафных
+  вопросов (invert_score) знак перевёрнут — выбор там должен уводить
+  p из row1, поэтому и у них «> 0» значит «вопрос работает как задуман»;
+- среднюю межпунктовую корреляцию с другими вопросами той же колонки
+  (по одинаковым потенциалам).
+
+Архив читается потоком пачками, копятся только суммы, поэтому память
+не зависит от числа клиентов. Результат — data/analytics/items.json.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+import warnings
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+import neo_storage
+from neo_questionnaire import BLOCKS_PATH, Questionnaire, load_questionnaire
+from neo_scoring import COLUMNS, POTENTIAL_IDS, answers_error, encode_answers, matrix_rows, score_counts
+
+
+ITEMS_PATH = os.path.join(neo_storage.DATA_DIR, "analytics", "items.json")
+
+
+def _pearson(n: float, sx: np.ndarray, sy: np.ndarray, sxy: np.ndarray) -> np.ndarray:
+    # корреляция Пирсона по суммам бинарных признаков (x² = x), nan при нулевой дисперсии
+    num = n * sxy - sx * sy
+    den = np.sqrt((n * sx - sx * sx) * (n * sy - sy * sy))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den > 0, num / np.where(den > 0, den, 1.0), np.nan)
+
+
+class ItemStats:
+    """
+    Накопитель сумм для item analysis; update() — на каждую пачку респондентов.
+    """
+
+    def __init__(self, questionnaire: Questionnaire):
+        self.q = questionnaire
+        compiled = questionnaire.compiled
+        n_q, n_p = len(compiled.items), len(POTENTIAL_IDS)
+        self.col_of = np.array([compiled.column_index[item.column] for item in compiled.items], dtype=np.int64)
+
+        self.n = 0
+        self.answered = np.zeros(n_q, dtype=np.int64)
+        self.sx = np.zeros((n_q, n_p), dtype=np.int64)  # Σ x[q, p]
+        self.sy = np.zeros((len(COLUMNS), n_p), dtype=np.int64)  # Σ [p в row1 колонки]
+        self.sxy = np.zeros((n_q, n_p), dtype=np.int64)  # Σ x[q, p] · y[col(q), p]
+        # по колонке: X^T X для X = (респонденты, вопросы колонки × потенциалы)
+        self.col_items = [np.nonzero(self.col_of == ci)[0] for ci in range(len(COLUMNS))]
+        self.gram = [np.zeros((len(ix) * n_p, len(ix) * n_p), dtype=np.int64) for ix in self.col_items]
+
+    def update(self, answers_list: List[Dict[str, Any]]):
+        if not answers_list:
+            return
+        compiled = self.q.compiled
+        counts = encode_answers(compiled, answers_list)
+        x = (counts > 0).astype(np.int64)  # (R, Q, P)
+
+        pos, neg = score_counts(compiled, counts)
+        row1 = matrix_rows(pos, neg)[:, :, 0]  # (R, C)
+        y = np.zeros((len(answers_list), len(COLUMNS), len(POTENTIAL_IDS)), dtype=np.int64)
+        r_idx, c_idx = np.indices(row1.shape)
+        y[r_idx, c_idx, row1] = 1
+
+        self.n += len(answers_list)
+        self.answered += x.any(axis=2).sum(axis=0)
+        self.sx += x.sum(axis=0)
+        self.sy += y.sum(axis=0)
+        self.sxy += np.einsum("rqp,rqp->qp", x, y[:, self.col_of, :])
+        for ci, ix in enumerate(self.col_items):
+            xc = x[:, ix, :].reshape(len(answers_list), -1)
+            self.gram[ci] += xc.T @ xc
+
+    def result(self) -> Dict[str, Any]:
+        compiled = self.q.compiled
+        n_p = len(POTENTIAL_IDS)
+        n = float(self.n)
+
+        disc = _pearson(n, self.sx, self.sy[self.col_of], self.sxy)  # (Q, P)
+        # штрафной вопрос тянет потенциал вниз: ожидаемая корреляция отрицательная
+        invert = np.array([item.invert for item in compiled.items], dtype=bool)
+        disc[invert] *= -1.0
+        raw_by_id = {str(qq.get("id")): qq for qq in compiled.questions}
+
+        inter = np.full(len(compiled.items), np.nan)
+        for ci, ix in enumerate(self.col_items):
+            if len(ix) < 2:
+                continue
+            g = self.gram[ci].astype(np.float64)
+            s = np.diag(g)  # Σ x (бинарные признаки)
+            corr = _pearson(n, s[:, None], s[None, :], g)
+            corr = corr.reshape(len(ix), n_p, len(ix), n_p)
+            # пара вопросов: среднее по одинаковым потенциалам
+            pair = _nanmean(np.einsum("apbp->abp", corr), axis=2)
+            np.fill_diagonal(pair, np.nan)
+            inter[ix] = _nanmean(pair, axis=1)
+
+        items: Dict[str, Any] = {}
+        for qi, item in enumerate(compiled.items):
+            raw = raw_by_id.get(item.qid, {})
+            offered = [
+                str(o.get("potential")).strip().lower()
+                for o in (raw.get("options") or [])
+                if isinstance(o, dict) and o.get("potential")
+            ]
+            # варианты вопроса + всё, что реально выбирали
+            pids = list(dict.fromkeys(offered + [POTENTIAL_IDS[p] for p in np.nonzero(self.sx[qi])[0]]))
+            answered = int(self.answered[qi])
+            items[item.qid] = {
+                "column": item.column,
+                "weight": item.weight,
+                "invert_multiplier": item.invert_multiplier,
+                "invert": item.invert,
+                "answered": answered,
+                "freq": {pid: (round(float(self.sx[qi, POTENTIAL_IDS.index(pid)] / answered), 4) if answered else 0.0) for pid in pids},
+                "disc": {pid: _num(disc[qi, POTENTIAL_IDS.index(pid)]) for pid in pids},
+                "discrimination": _num(_nanmean(np.array([disc[qi, POTENTIAL_IDS.index(p)] for p in pids]))) if pids else None,
+                "inter_item": _num(inter[qi]),
+            }
+
+        return {
+            "computed_at": int(time.time()),
+            "questionnaire_version": self.q.version,
+            "questionnaire_hash": self.q.content_hash,
+            "respondents": self.n,
+            "items": items,
+        }
+
+
+def _nanmean(a: np.ndarray, axis=None):
+    # nanmean без предупреждений на полностью пустых срезах
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(a, axis=axis)
+
+
+def _num(v) -> Optional[float]:
+    v = float(v)
+    return None if np.isnan(v) else round(v, 4)
+
+
+def iter_archive_answers() -> Iterable[Dict[str, Any]]:
+    # потоком: только responses.json завершённых сессий, битые пропускаем
+    for _, path in neo_storage.iter_client_dirs():
+        responses = neo_storage.safe_read_json(os.path.join(path, "responses.json"))
+        if answers_error(responses) is None:
+            yield responses
+
+
+def compute(questionnaire: Optional[Questionnaire] = None, chunk_size: int = 4096) -> Dict[str, Any]:
+    q = questionnaire or load_questionnaire(BLOCKS_PATH)
+    stats = ItemStats(q)
+    it = iter(iter_archive_answers())
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            break
+        stats.update(chunk)
+    return stats.result()
+
+
+def run(path: str = ITEMS_PATH) -> Dict[str, Any]:
+    result = compute()
+    neo_storage.save_json(path, result)
+    return result
+
+
+def load_result(path: str = ITEMS_PATH) -> Optional[Dict[str, Any]]:
+    return neo_storage.safe_read_json(path)
+
+
+if __name__ == "__main__":
+    res = run()
+    print(f"Готово: {res['respondents']} респондентов, {len(res['items'])} вопросов -> {ITEMS_PATH}", file=sys.stderr)
@@ -0,0 +1,159 @@
+# neo_metrics.py
+"""
+Лёгкие таймеры и счётчики для горячих мест (загрузка опросника,
+нормализация, рендер вопроса, save_json, скоринг).
+
+По умолчанию выключено: включается переменной окружения NEO_METRICS=1
+до старта процесса. В выключенном состоянии @timed возвращает функцию
+как есть, а observe()/incr() ничего не делают.
+
+Метрики живут в памяти процесса Streamlit (общие для всех сессий);
+для каждого таймера хранятся последние RECENT замеров — по ним
+считаются перцентили. Выгрузка — snapshot() / to_json() / to_prometheus().
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+ENABLED = os.environ.get("NEO_METRICS", "").strip().lower() in ("1", "true", "yes", "on")
+
+RECENT = 2048
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class _Timer:
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=RECENT)
+
+
+_lock = threading.Lock()
+_timers: Dict[str, _Timer] = {}
+_counters: Dict[str, int] = {}
+_started = time.time()
+
+
+def observe(name: str, seconds: float):
+    """
+    Записать один замер таймера name (в секундах).
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        t = _timers.get(name)
+        if t is None:
+            t = _timers[name] = _Timer()
+        t.count += 1
+        t.total += seconds
+        if seconds > t.max:
+            t.max = seconds
+        t.recent.append(seconds)
+
+
+def incr(name: str, n: int = 1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """
+    Декоратор-таймер. При выключенных метриках функция не оборачивается,
+    чтобы горячий путь скоринга не платил ни за что.
+    """
+
+    def deco(fn: Callable) -> Callable:
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - t0)
+
+        return wrapper
+
+    return deco
+
+
+def _quantile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def snapshot() -> Dict[str, Any]:
+    """
+    {"enabled", "started_at", "timers": {name: {count, sum, max, p50, p90, p99}}, "counters": {...}}
+    Перцентили — по последним RECENT замерам, секунды.
+    """
+    with _lock:
+        timers = {name: (t.count, t.total, t.max, sorted(t.recent)) for name, t in _timers.items()}
+        counters = dict(_counters)
+
+    out_timers: Dict[str, Dict[str, float]] = {}
+    for name, (count, total, mx, recent) in sorted(timers.items()):
+        row: Dict[str, float] = {"count": count, "sum": total, "max": mx}
+        for q in QUANTILES:
+            row[f"p{int(q * 100)}"] = _quantile(recent, q)
+        out_timers[name] = row
+
+    return {
+        "enabled": ENABLED,
+        "started_at": int(_started),
+        "timers": out_timers,
+        "counters": dict(sorted(counters.items())),
+    }
+
+
+def to_json(snap: Optional[Dict[str, Any]] = None) -> str:
+    return json.dumps(snap or snapshot(), ensure_ascii=False, indent=2)
+
+
+def _prom_name(name: str) -> str:
+    return "neo_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def to_prometheus(snap: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Текстовый формат Prometheus: таймеры — summary, счётчики — counter.
+    """
+    snap = snap or snapshot()
+    lines = []
+    for name, t in snap["timers"].items():
+        metric = _prom_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for q in QUANTILES:
+            lines.append(f'{metric}{{quantile="{q}"}} {t[f"p{int(q * 100)}"]:.9f}')
+        lines.append(f"{metric}_sum {t['sum']:.9f}")
+        lines.append(f"{metric}_count {t['count']}")
+    for name, value in snap["counters"].items():
+        metric = _prom_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    global _started
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _started = time.time()
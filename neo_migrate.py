@@ -0,0 +1,38 @@
+# neo_migrate.py
+"""
+Разовый перенос папок клиентов в шардированную раскладку:
+
+    data/clients/<client_id>/  ->  data/clients/<shard>/<client_id>/
+
+    python neo_migrate.py --dry-run   # только посчитать
+    python neo_migrate.py
+
+Запускать при остановленном приложении. Индекс клиентов хранит только
+client_id, поэтому его трогать не нужно; до миграции client_dir()
+находит и старые, и новые папки.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import List, Optional
+
+import neo_storage
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Перенос data/clients в шардированную раскладку")
+    parser.add_argument("--dry-run", action="store_true", help="ничего не переносить, только посчитать")
+    args = parser.parse_args(argv)
+
+    moved, conflicts = neo_storage.migrate_layout(dry_run=args.dry_run)
+    for cid in conflicts:
+        print(f"[конфликт] {cid}: папка уже есть в шарде, старая оставлена на месте", file=sys.stderr)
+
+    verb = "будет перенесено" if args.dry_run else "перенесено"
+    print(f"Готово: {verb} {moved}, конфликтов {len(conflicts)}")
+    return 1 if conflicts else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
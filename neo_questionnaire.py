@@ -0,0 +1,252 @@
+# neo_questionnaire.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from neo_metrics import incr, timed
+from neo_scoring import CompiledQuestionnaire, compile_questionnaire
+from neo_storage import save_json
+
+
+BLOCKS_PATH = "neo_blocks.json"
+
+
+def get_opt_label(opt: dict) -> str:
+    return opt.get("label") or opt.get("text") or opt.get("title") or ""
+
+
+def get_opt_potential(opt: dict) -> str:
+    return (opt.get("potential") or opt.get("potential_id") or opt.get("id") or opt.get("code") or "").strip()
+
+
+def is_single(qtype: str) -> bool:
+    qtype = (qtype or "").lower()
+    return qtype in ("single_select", "single_choice", "radio")
+
+
+def is_multi(qtype: str) -> bool:
+    qtype = (qtype or "").lower()
+    return qtype in ("multi_select", "multi_choice", "checkbox")
+
+
+@dataclass(frozen=True)
+class QuestionView:
+    """
+    Всё, что визарду нужно для отрисовки вопроса, посчитанное один раз
+    на версию опросника: подписи вариантов и обе стороны
+    соответствия подпись <-> потенциал.
+    """
+
+    qid: Optional[str]
+    qtype: str
+    # "single" / "multi" / "text" / "" — какой виджет рисовать
+    kind: str
+    prompt: str
+    block_name: str
+    block_code: str
+    labels: Tuple[str, ...]
+    potentials: Tuple[str, ...]
+    potential_by_label: Dict[str, str]
+    index_by_potential: Dict[str, int]
+    max_choices: Optional[int]
+    text_field: bool
+
+    def default_index(self, selected: List[str]) -> Optional[int]:
+        # индекс для st.radio по прошлому ответу
+        return self.index_by_potential.get(selected[0]) if selected else None
+
+    def default_labels(self, selected: List[str]) -> List[str]:
+        # подписи для st.multiselect по прошлому ответу
+        return [self.labels[self.index_by_potential[p]] for p in selected if p in self.index_by_potential]
+
+
+def build_view(q: Dict[str, Any], block_name: str = "", block_code: str = "") -> QuestionView:
+    labels: List[str] = []
+    potentials: List[str] = []
+    for opt in q.get("options", []) or []:
+        if not isinstance(opt, dict):
+            continue
+        pot = get_opt_potential(opt)
+        lab = get_opt_label(opt)
+        if not pot or not lab:
+            continue
+        potentials.append(pot)   # amber / citrine / heliodor ...
+        labels.append(lab)       # человекочитаемо
+
+    potential_by_label: Dict[str, str] = {}
+    index_by_potential: Dict[str, int] = {}
+    # при повторах побеждает первый вариант (как list.index раньше)
+    for i, (lab, pot) in enumerate(zip(labels, potentials)):
+        potential_by_label.setdefault(lab, pot)
+        index_by_potential.setdefault(pot, i)
+
+    try:
+        max_choices = int(q["max_choices"]) if q.get("max_choices") else None
+    except (TypeError, ValueError):
+        max_choices = None
+
+    qtype = (q.get("type") or "").lower()
+    if is_single(qtype):
+        kind = "single"
+    elif is_multi(qtype):
+        kind = "multi"
+    elif qtype == "text":
+        kind = "text"
+    else:
+        kind = ""
+
+    return QuestionView(
+        qid=q.get("id"),
+        qtype=qtype,
+        kind=kind,
+        prompt=q.get("prompt") or "",
+        block_name=block_name,
+        block_code=block_code,
+        labels=tuple(labels),
+        potentials=tuple(potentials),
+        potential_by_label=potential_by_label,
+        index_by_potential=index_by_potential,
+        max_choices=max_choices,
+        text_field=bool(q.get("text_field", False)),
+    )
+
+
+@timed("questionnaire.normalize")
+def _flat_questions(blocks_data: dict) -> List[Tuple[Dict[str, Any], str, str]]:
+    # (вопрос, имя блока, код блока) в порядке order; сами словари не копируем
+    blocks = blocks_data.get("blocks", [])
+    if not isinstance(blocks, list):
+        return []
+
+    flat = []
+    for b in blocks:
+        bname = b.get("block_name") or b.get("name") or ""
+        bcode = b.get("block_code") or b.get("code") or ""
+        qs = b.get("questions", [])
+        if not isinstance(qs, list):
+            continue
+        for q in qs:
+            if isinstance(q, dict):
+                flat.append((q, bname, bcode))
+
+    # сортируем по order если есть
+    def keyfn(entry):
+        try:
+            return int(entry[0].get("order", 9999))
+        except Exception:
+            return 9999
+
+    flat.sort(key=keyfn)
+    return flat
+
+
+@dataclass(frozen=True)
+class Questionnaire:
+    """
+    Разобранный neo_blocks.json: сырой словарь, вопросы для визарда,
+    их QuestionView (views[i] соответствует questions[i])
+    и скомпилированный опросник для скоринга.
+    Общий на весь процесс — менять содержимое нельзя.
+    """
+
+    path: str
+    mtime_ns: int
+    size: int
+    content_hash: str
+    blocks: Dict[str, Any]
+    questions: List[Dict[str, Any]]
+    views: Tuple[QuestionView, ...]
+    compiled: CompiledQuestionnaire
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.compiled.version
+
+
+_cache: Dict[str, Questionnaire] = {}
+_lock = threading.Lock()
+
+
+@timed("questionnaire.parse")
+def _build(path: str, raw: bytes, content_hash: str, st: os.stat_result) -> Questionnaire:
+    blocks = json.loads(raw.decode("utf-8"))
+    flat = _flat_questions(blocks)
+    return Questionnaire(
+        path=path,
+        mtime_ns=st.st_mtime_ns,
+        size=st.st_size,
+        content_hash=content_hash,
+        blocks=blocks,
+        questions=[q for q, _, _ in flat],
+        views=tuple(build_view(q, bname, bcode) for q, bname, bcode in flat),
+        compiled=compile_questionnaire(blocks),
+    )
+
+
+def load_questionnaire(path: str = BLOCKS_PATH) -> Questionnaire:
+    """
+    Возвращает опросник из кэша процесса.
+    Файл перечитывается, только если изменились mtime/размер, и
+    заново разбирается, только если изменился sha256 содержимого.
+    Ошибки чтения/JSON пробрасываются вызывающему.
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+
+    cached = _cache.get(key)
+    if cached is not None and cached.mtime_ns == st.st_mtime_ns and cached.size == st.st_size:
+        incr("questionnaire.cache_hit")
+        return cached
+
+    incr("questionnaire.cache_miss")
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and cached.mtime_ns == st.st_mtime_ns and cached.size == st.st_size:
+            return cached
+
+        with open(key, "rb") as f:
+            raw = f.read()
+        content_hash = hashlib.sha256(raw).hexdigest()
+
+        if cached is not None and cached.content_hash == content_hash:
+            # файл «тронули», но содержимое то же — разбирать заново незачем
+            fresh = Questionnaire(
+                path=cached.path,
+                mtime_ns=st.st_mtime_ns,
+                size=st.st_size,
+                content_hash=content_hash,
+                blocks=cached.blocks,
+                questions=cached.questions,
+                views=cached.views,
+                compiled=cached.compiled,
+            )
+        else:
+            fresh = _build(key, raw, content_hash, st)
+
+        _cache[key] = fresh
+        return fresh
+
+
+def invalidate(path: Optional[str] = None):
+    with _lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(os.path.abspath(path), None)
+
+
+def save_blocks(blocks: Dict[str, Any], path: str = BLOCKS_PATH) -> Questionnaire:
+    """
+    Сохраняет neo_blocks.json (атомарно) и сразу
+    обновляет кэш, чтобы следующий rerun увидел новую версию.
+    """
+    key = os.path.abspath(path)
+    save_json(key, blocks)
+
+    invalidate(key)
+    return load_questionnaire(key)
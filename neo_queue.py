@@ -0,0 +1,144 @@
+# neo_queue.py
+"""
+Фоновый расчёт отчётов.
+
+«Завершить» в визарде только сохраняет responses.json и ставит задачу
+(neo_storage.enqueue_report, статус клиента — pending). Отчёт считает
+воркер:
+
+- по умолчанию — поток внутри процесса Streamlit (start_worker());
+- NEO_QUEUE_WORKER=external — отдельный процесс:
+      python neo_queue.py           # слушать очередь
+      python neo_queue.py --once    # разобрать то, что есть, и выйти
+
+Задачи лежат в таблице jobs индекса клиентов, поэтому воркеров может
+быть несколько: claim_jobs не отдаст одну задачу дважды.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional
+
+import neo_storage
+from neo_metrics import incr, timed
+from neo_questionnaire import BLOCKS_PATH, load_questionnaire
+
+
+POLL_SECONDS = 2.0
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+# пауза перед повтором после ошибки: 10, 20, 40, 80 с — переживаем
+# временные сбои (занятая БД, недописанный файл), а не сжигаем попытки подряд
+RETRY_DELAY_SECONDS = 10.0
+# взятая, но не закрытая за это время задача считается брошенной (воркер умер)
+STALE_CLAIM_SECONDS = 300
+
+
+@timed("queue.process")
+def process(client_ids: List[str], blocks_path: str = BLOCKS_PATH) -> int:
+    """
+    Считает отчёты для взятых задач. Возвращает число успешных.
+    """
+    questionnaire = load_questionnaire(blocks_path)
+    ok = 0
+    for cid in client_ids:
+        try:
+            report = neo_storage.ensure_report(cid, questionnaire)
+            if report is None:
+                raise RuntimeError("нет responses.json")
+        except Exception as e:
+            neo_storage.finish_job(
+                cid,
+                error=f"{type(e).__name__}: {e}",
+                max_attempts=MAX_ATTEMPTS,
+                retry_delay=RETRY_DELAY_SECONDS,
+            )
+            incr("queue.failed")
+            continue
+        neo_storage.finish_job(cid)
+        incr("queue.done")
+        ok += 1
+    return ok
+
+
+def run_once(limit: int = BATCH_SIZE, blocks_path: str = BLOCKS_PATH) -> int:
+    """
+    Разбирает очередь пачками, пока не кончатся готовые к запуску задачи
+    (отложенные повторы ждут следующего прохода). Возвращает число отчётов.
+    """
+    done = 0
+    while True:
+        ids = neo_storage.claim_jobs(limit, STALE_CLAIM_SECONDS, MAX_ATTEMPTS)
+        if not ids:
+            return done
+        done += process(ids, blocks_path)
+
+
+_wake = threading.Event()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def _loop(blocks_path: str):
+    while True:
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+        try:
+            run_once(blocks_path=blocks_path)
+        except Exception:
+            # воркер не должен умирать из-за одной ошибки (например, занятой БД)
+            traceback.print_exc()
+
+
+def start_worker(blocks_path: str = BLOCKS_PATH) -> bool:
+    """
+    Запускает фоновый поток-воркер (один на процесс).
+    При NEO_QUEUE_WORKER=external ничего не делает — очередь разбирает
+    отдельный процесс. Возвращает True, если поток работает.
+    """
+    global _worker
+    if os.environ.get("NEO_QUEUE_WORKER", "").strip().lower() == "external":
+        return False
+    if _worker is not None and _worker.is_alive():
+        return True
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_loop, args=(os.path.abspath(blocks_path),), name="neo-queue", daemon=True)
+            _worker.start()
+    return True
+
+
+def kick():
+    # разбудить поток-воркер сразу после постановки задачи
+    _wake.set()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Воркер очереди расчёта отчётов")
+    parser.add_argument("--blocks", default=BLOCKS_PATH)
+    parser.add_argument("--once", action="store_true", help="разобрать очередь и выйти")
+    args = parser.parse_args(argv)
+
+    if args.once:
+        n = run_once(blocks_path=args.blocks)
+        print(f"Готово: {n} отчётов")
+        return 0
+
+    print("Слушаю очередь (Ctrl+C — выход)", file=sys.stderr)
+    try:
+        while True:
+            n = run_once(blocks_path=args.blocks)
+            if n:
+                print(f"посчитано отчётов: {n}", file=sys.stderr, flush=True)
+            time.sleep(POLL_SECONDS)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
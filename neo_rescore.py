@@ -0,0 +1,212 @@
+# neo_rescore.py
+"""
+Массовый пересчёт report.json по текущему neo_blocks.json.
+
+    python neo_rescore.py                 # пересчитать устаревшие отчёты
+    python neo_rescore.py --dry-run       # только показать, у кого изменится матрица
+    python neo_rescore.py --force -j 8    # пересчитать все, 8 процессов
+
+Клиенты читаются потоком из data/clients/*/responses.json, пачки
+обрабатываются пулом процессов, отчёты пишутся атомарно.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import neo_storage
+from neo_questionnaire import BLOCKS_PATH, Questionnaire, load_questionnaire
+from neo_scoring import COLUMNS, ROWS, answers_error, iter_score_many, score_blocks
+
+
+# статусы результата по одному клиенту
+UNCHANGED = "unchanged"
+RESCORED = "rescored"
+NO_RESPONSES = "no_responses"
+ERROR = "error"
+
+_questionnaire: Optional[Questionnaire] = None
+
+
+def _init_worker(blocks_path: str):
+    # опросник разбираем один раз на процесс
+    global _questionnaire
+    _questionnaire = load_questionnaire(blocks_path)
+
+
+def matrix_diff(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> List[str]:
+    """
+    Отличия матриц в виде строк "perception.row1: amber -> citrine".
+    """
+    old_m = (old or {}).get("matrix") if isinstance(old, dict) else None
+    old_m = old_m if isinstance(old_m, dict) else {}
+    out = []
+    for col in COLUMNS:
+        old_col = old_m.get(col) if isinstance(old_m.get(col), dict) else {}
+        for row in ROWS:
+            a = old_col.get(row)
+            b = new["matrix"][col][row]
+            if a != b:
+                out.append(f"{col}.{row}: {a or '—'} -> {b or '—'}")
+    return out
+
+
+def rescore_batch(client_ids: List[str], dry_run: bool, force: bool) -> List[Tuple[str, str, List[str]]]:
+    """
+    Пересчитывает пачку клиентов в процессе-воркере.
+    Возвращает [(client_id, статус, diff матрицы), ...].
+    """
+    q = _questionnaire
+    assert q is not None, "_init_worker не вызван"
+
+    results: List[Tuple[str, str, List[str]]] = []
+    todo: List[Tuple[str, Dict[str, Any], Optional[Dict[str, Any]]]] = []
+
+    for cid in client_ids:
+        cdir = neo_storage.client_dir(cid)
+        responses = neo_storage.safe_read_json(os.path.join(cdir, "responses.json"))
+        if not isinstance(responses, dict):
+            results.append((cid, NO_RESPONSES, []))
+            continue
+        problem = answers_error(responses)
+        if problem is not None:
+            results.append((cid, ERROR, [problem]))
+            continue
+        old = neo_storage.safe_read_json(os.path.join(cdir, "report.json"))
+        if not force and neo_storage.is_report_current(old, q, responses):
+            results.append((cid, UNCHANGED, []))
+            continue
+        todo.append((cid, responses, old))
+
+    # сам скоринг — векторный, пачкой; если пачка упала на каком-то
+    # клиенте — считаем по одному, чтобы ошибка досталась только ему
+    try:
+        reports: List[Optional[Dict[str, Any]]] = list(
+            iter_score_many(q.compiled, (responses for _, responses, _ in todo))
+        )
+    except Exception:
+        reports = [None] * len(todo)
+
+    for (cid, responses, old), report in zip(todo, reports):
+        try:
+            if report is None:
+                report = score_blocks(q.compiled, responses)
+            diff = matrix_diff(old, report)
+            if not dry_run:
+                neo_storage.stamp_report(report, q, responses)
+                neo_storage.save_json(os.path.join(neo_storage.client_dir(cid), "report.json"), report, compact=True)
+            results.append((cid, RESCORED, diff))
+        except Exception as e:
+            results.append((cid, ERROR, [str(e)]))
+
+    return results
+
+
+def _batches(batch_size: int) -> Iterator[List[str]]:
+    it = (cid for cid, path in neo_storage.iter_client_dirs())
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def default_workers() -> int:
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+def run(
+    blocks_path: str = BLOCKS_PATH,
+    workers: Optional[int] = None,
+    batch_size: int = 256,
+    dry_run: bool = False,
+    force: bool = False,
+    out=sys.stdout,
+    progress=sys.stderr,
+) -> Dict[str, int]:
+    # проверяем опросник заранее, чтобы не поднимать пул впустую
+    q = load_questionnaire(blocks_path)
+    workers = workers or default_workers()
+    print(
+        f"Опросник {q.version or '—'} ({q.content_hash[:12]}), процессов: {workers}"
+        + (", dry-run" if dry_run else ""),
+        file=progress,
+    )
+
+    counts = {UNCHANGED: 0, RESCORED: 0, NO_RESPONSES: 0, ERROR: 0}
+    started = time.monotonic()
+    done = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(blocks_path,)) as pool:
+        batches = _batches(batch_size)
+        pending = set()
+        # держим в работе ограниченное число пачек — архив идёт потоком
+        max_inflight = workers * 2
+
+        while True:
+            while len(pending) < max_inflight:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.add(pool.submit(rescore_batch, batch, dry_run, force))
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                rescored: List[str] = []
+                for cid, status, diff in fut.result():
+                    counts[status] += 1
+                    done += 1
+                    if status == RESCORED:
+                        rescored.append(cid)
+                    if status == ERROR:
+                        print(f"[error] {cid}: {'; '.join(diff)}", file=out)
+                    elif diff and dry_run:
+                        print(f"{cid}: " + ", ".join(diff), file=out)
+
+                if rescored and not dry_run:
+                    neo_storage.set_report_statuses(rescored, neo_storage.REPORT_DONE)
+
+            rate = done / max(time.monotonic() - started, 1e-9)
+            print(
+                f"\rобработано {done} • пересчитано {counts[RESCORED]} • без изменений {counts[UNCHANGED]}"
+                f" • ошибок {counts[ERROR]} • {rate:.0f}/с",
+                end="",
+                file=progress,
+                flush=True,
+            )
+
+    print("", file=progress)
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Пересчёт report.json по текущему neo_blocks.json")
+    parser.add_argument("--blocks", default=BLOCKS_PATH, help="путь к neo_blocks.json")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="число процессов (по умолчанию — все доступные ядра)")
+    parser.add_argument("--batch-size", type=int, default=256, help="клиентов в одной задаче воркера")
+    parser.add_argument("--dry-run", action="store_true", help="ничего не писать, показать изменения матриц")
+    parser.add_argument("--force", action="store_true", help="пересчитать даже актуальные отчёты")
+    args = parser.parse_args(argv)
+
+    counts = run(
+        blocks_path=args.blocks,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+        force=args.force,
+    )
+    return 1 if counts[ERROR] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
 # neo_scoring.py
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from typing import Any, Dict, List, Tuple, Optional
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Optional, Union
+
+import numpy as np
+
+from neo_metrics import timed
 
 
 # --- базовый список потенциалов (id) ---
@@ -20,28 +25,99 @@ POTENTIAL_IDS = [
 
 COLUMNS = ["perception", "motivation", "instrument"]
 
+POTENTIAL_INDEX = {pid: i for i, pid in enumerate(POTENTIAL_IDS)}
+
+ROWS = ["row1", "row2", "row3"]
 
-@dataclass
-class PotentialScore:
-    # положительные баллы (выборы в обычных вопросах)
-    pos: Dict[str, float] = field(default_factory=lambda: {c: 0.0 for c in COLUMNS})
-    # отрицательные баллы (выборы в invert_score вопросах)
-    neg: Dict[str, float] = field(default_factory=lambda: {c: 0.0 for c in COLUMNS})
+# служебные ключи внутри ответа-объекта со свободным текстом, а не вариантами:
+# {"selected": ["amber"], "note": "Янтарь"} — это один выбор, а не два
+FREE_TEXT_KEYS = ("note", "text", "comment")
 
-    def add_pos(self, col: str, v: float):
-        if col in self.pos:
-            self.pos[col] += v
+REPORT_NOTE = "Row3 (weakness) is assigned only if invert_score evidence exists in that column."
 
-    def add_neg(self, col: str, v: float):
-        if col in self.neg:
-            self.neg[col] += v
 
-    def effective(self, col: str, invert_multiplier: float = 1.0) -> float:
+class CompactReport:
+    """
+    Компактный результат скоринга одного респондента.
+
+    values — массив 9×3×2 (potential × column × [pos, neg]) в порядке
+    POTENTIAL_IDS/COLUMNS, rows — массив 3×3 индексов потенциалов
+    (column × row1..row3, -1 = нет). Словарь report.json собирается
+    только по запросу через to_report().
+    """
+
+    __slots__ = ("values", "rows")
+
+    def __init__(self, values: np.ndarray, rows: np.ndarray):
+        self.values = values
+        self.rows = rows
+
+    @classmethod
+    def from_values(cls, values: np.ndarray) -> "CompactReport":
+        rows = matrix_rows(values[None, :, :, 0], values[None, :, :, 1])[0]
+        return cls(values, rows.astype(np.int8))
+
+    @classmethod
+    def from_report(cls, report: Dict[str, Any]) -> "CompactReport":
+        """
+        Обратное к to_report(): читает сохранённый report.json.
+        Матрицу берём как есть (а не пересчитываем), отсутствующее — нули/нет.
+        """
+        scores = report.get("scores") if isinstance(report.get("scores"), dict) else {}
+        values = np.zeros((len(POTENTIAL_IDS), len(COLUMNS), 2), dtype=np.float64)
+        for pi, pid in enumerate(POTENTIAL_IDS):
+            s = scores.get(pid) if isinstance(scores.get(pid), dict) else {}
+            for k, part in enumerate(("pos", "neg")):
+                cells = s.get(part) if isinstance(s.get(part), dict) else {}
+                for ci, col in enumerate(COLUMNS):
+                    try:
+                        values[pi, ci, k] = float(cells.get(col) or 0.0)
+                    except Exception:
+                        pass
+
+        matrix = report.get("matrix") if isinstance(report.get("matrix"), dict) else {}
+        rows = np.full((len(COLUMNS), len(ROWS)), -1, dtype=np.int8)
+        for ci, col in enumerate(COLUMNS):
+            cells = matrix.get(col) if isinstance(matrix.get(col), dict) else {}
+            for ri, row in enumerate(ROWS):
+                rows[ci, ri] = POTENTIAL_INDEX.get(cells.get(row), -1)
+        return cls(values, rows)
+
+    def pos(self, pid: str, col: str) -> float:
+        return float(self.values[POTENTIAL_INDEX[pid], COLUMNS.index(col), 0])
+
+    def neg(self, pid: str, col: str) -> float:
+        return float(self.values[POTENTIAL_INDEX[pid], COLUMNS.index(col), 1])
+
+    def effective(self, pid: str, col: str) -> float:
         # “эффективный” скор — плюсы минус штрафы
-        return self.pos.get(col, 0.0) - (self.neg.get(col, 0.0) * invert_multiplier)
+        return self.pos(pid, col) - (self.neg(pid, col) * 1.0)
+
+    def matrix(self) -> Dict[str, Dict[str, Optional[str]]]:
+        return {
+            col: dict(zip(ROWS, [POTENTIAL_IDS[idx] if idx >= 0 else None for idx in col_rows]))
+            for col, col_rows in zip(COLUMNS, self.rows.tolist())
+        }
 
-    def total_effective(self, invert_multiplier: float = 1.0) -> float:
-        return sum(self.effective(c, invert_multiplier) for c in COLUMNS)
+    def to_report(self) -> Dict[str, Any]:
+        # собираем report.json привычной формы
+        out_scores: Dict[str, Any] = {}
+        for pid, cells in zip(POTENTIAL_IDS, self.values.tolist()):
+            by_col = {c: p - (n * 1.0) for c, (p, n) in zip(COLUMNS, cells)}
+            out_scores[pid] = {
+                "strength": float(sum(by_col.values())),
+                "by_column": by_col,
+                "pos": {c: p for c, (p, _) in zip(COLUMNS, cells)},
+                "neg": {c: n for c, (_, n) in zip(COLUMNS, cells)},
+            }
+
+        return {
+            "scores": out_scores,
+            "matrix": self.matrix(),
+            "meta": {
+                "note": REPORT_NOTE,
+            },
+        }
 
 
 def _safe_get_answers_map(answers_json: Dict[str, Any]) -> Dict[str, Any]:
@@ -53,6 +129,18 @@ def _safe_get_answers_map(answers_json: Dict[str, Any]) -> Dict[str, Any]:
     )
 
 
+def answers_error(answers_json: Any) -> Optional[str]:
+    """
+    Почему ответы нельзя посчитать (None — можно): скоринг ждёт объект
+    {id вопроса: ответ} — сам по себе или в поле answers/responses.
+    """
+    if not isinstance(answers_json, dict):
+        return "ответы должны быть JSON-объектом"
+    if not isinstance(_safe_get_answers_map(answers_json), dict):
+        return "answers должен быть объектом {id вопроса: ответ}"
+    return None
+
+
 def _extract_all_selected(raw_answer: Any) -> List[str]:
     """
     Превращает ответ любой формы в список строк:
@@ -60,28 +148,60 @@ def _extract_all_selected(raw_answer: Any) -> List[str]:
     - "opt_citrine"
     - ["opt_1","opt_3"]
     - {"fast":[...], "slow":[...]}
+    Свободный текст (ключи FREE_TEXT_KEYS) вариантом не считается.
     """
     out: List[str] = []
+    _collect_selected(raw_answer, out)
+    return out
 
-    if raw_answer is None:
-        return out
 
+def _collect_selected(raw_answer: Any, out: List[str]):
+    # горячий путь encode_answers: один общий список вместо списка на уровень,
+    # строки внутри списков/объектов дописываются без рекурсивного вызова
     if isinstance(raw_answer, str):
-        return [raw_answer]
-
-    if isinstance(raw_answer, list):
+        out.append(raw_answer)
+    elif isinstance(raw_answer, list):
         for x in raw_answer:
-            out.extend(_extract_all_selected(x))
-        return out
-
-    if isinstance(raw_answer, dict):
+            if isinstance(x, str):
+                out.append(x)
+            else:
+                _collect_selected(x, out)
+    elif isinstance(raw_answer, dict):
         # иногда ответы лежат как {"selected":[...]} или {"fast":[...]}
-        for _, v in raw_answer.items():
-            out.extend(_extract_all_selected(v))
-        return out
+        for k, v in raw_answer.items():
+            if k in FREE_TEXT_KEYS:
+                continue
+            if isinstance(v, str):
+                out.append(v)
+            else:
+                _collect_selected(v, out)
+    # всё остальное (None, числа) игнорируем
 
-    # всё остальное игнорируем
-    return out
+
+def _selection_counts(compiled: "CompiledQuestionnaire", qid: str, raw_answer: Any) -> Dict[int, int]:
+    """
+    Сколько раз каждый потенциал выбран в ответе на вопрос: {индекс потенциала: count}.
+    Вклад в ячейку — count * delta одним сложением (а не count сложений delta),
+    по тому же правилу, что encode_answers/score_counts: так скалярный
+    и пакетный пути дают побитово одинаковые суммы при любых весах.
+    """
+    counts: Dict[int, int] = {}
+    for t in _extract_all_selected(raw_answer):
+        hit = compiled.resolve(qid, t)
+        if hit is not None:
+            pi = POTENTIAL_INDEX[hit[1]]
+            counts[pi] = counts.get(pi, 0) + 1
+    return counts
+
+
+def _fold(text: str) -> str:
+    """
+    Ключ для поиска без учёта написания:
+    - регистр (casefold), ё -> е
+    - пробелы по краям и повторные пробелы внутри
+    "  Янтарь " / "ЯНТАРЬ" -> "янтарь"
+    """
+    return " ".join(str(text or "").casefold().replace("ё", "е").split())
 
 
 def _normalize_token(token: str) -> str:
@@ -90,12 +210,41 @@ def _normalize_token(token: str) -> str:
     - "opt_citrine" -> "citrine"
     - "  citrine " -> "citrine"
     """
-    t = (token or "").strip().lower()
+    t = _fold(token)
     if t.startswith("opt_"):
         t = t[4:]
     return t
 
 
+def _potential_names(blocks_json: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Человекочитаемые имена потенциалов из "potentials":
+    _fold(имя) -> potential_id. Поддерживает оба формата:
+    {"amber": {"ru": "Янтарь"}} и [{"id": "amber", "name": "Янтарь"}].
+    """
+    p = blocks_json.get("potentials")
+    if isinstance(p, dict):
+        entries = [(pid, meta) for pid, meta in p.items()]
+    elif isinstance(p, list):
+        entries = [
+            (item.get("potential_id") or item.get("id") or item.get("code"), item)
+            for item in p
+            if isinstance(item, dict)
+        ]
+    else:
+        return {}
+
+    names: Dict[str, str] = {}
+    for pid, meta in entries:
+        pid = str(pid or "").strip().lower()
+        if pid not in POTENTIAL_IDS or not isinstance(meta, dict):
+            continue
+        for k in ("ru", "name", "title", "en"):
+            if meta.get(k):
+                names[_fold(meta[k])] = pid
+    return names
+
+
 def _build_q_option_map(question: Dict[str, Any]) -> Dict[str, str]:
     """
     Для каждого вопроса строим словарь:
@@ -105,6 +254,7 @@ def _build_q_option_map(question: Dict[str, Any]) -> Dict[str, str]:
     - потенциальные id в опциях: {"potential":"citrine"}
     - если есть {"id":"opt_3"} то тоже маппим
     - если id нет, создаём "opt_1", "opt_2"... (как раньше)
+    - текст варианта (label/text/title), без учёта регистра
     """
     m: Dict[str, str] = {}
     options = question.get("options", []) or []
@@ -117,6 +267,11 @@ def _build_q_option_map(question: Dict[str, Any]) -> Dict[str, str]:
             continue
         pid = str(pid).strip().lower()
 
+        # 0) текст варианта, как его видел респондент
+        label = opt.get("label") or opt.get("text") or opt.get("title")
+        if label:
+            m[_fold(label)] = pid
+
         # 1) прямое имя потенциала
         m[pid] = pid
 
@@ -126,7 +281,7 @@ def _build_q_option_map(question: Dict[str, Any]) -> Dict[str, str]:
         # 3) явный id, если есть
         opt_id = opt.get("id")
         if opt_id:
-            m[str(opt_id).strip().lower()] = pid
+            m[_fold(opt_id)] = pid
 
         # 4) старый формат без id: opt_1/opt_2/...
         m[f"opt_{i}"] = pid
@@ -162,38 +317,62 @@ def _all_questions(blocks_json: Dict[str, Any]) -> List[Dict[str, Any]]:
     return qs
 
 
-def score_blocks(blocks_json: Dict[str, Any], answers_json: Dict[str, Any]) -> Dict[str, Any]:
+@dataclass(frozen=True)
+class CompiledQuestion:
+    qid: str
+    column: str
+    weight: float
+    invert: bool
+    invert_multiplier: float
+    # сколько баллов даёт один выбор в этом вопросе (уже с учётом invert_multiplier)
+    delta: float
+    # смещение ячейки внутри потенциала в плоском массиве column × [pos, neg]
+    slot: int
+    # индексы потенциалов, которые можно выбрать в вопросе (для границ адаптивного режима)
+    options: Tuple[int, ...] = ()
+
+
+@dataclass(frozen=True)
+class CompiledQuestionnaire:
     """
-    Главная функция для Streamlit.
-    Возвращает report.json со структурой:
-    {
-      "scores": {
-        "citrine": {"strength": ..., "by_column": {...}, "pos":..., "neg":...},
-        ...
-      },
-      "matrix": {
-         "perception": {"row1": "...", "row2": "...", "row3": "..."},
-         ...
-      }
-    }
+    Опросник, один раз разобранный из neo_blocks.json.
+
+    Хранит отсортированные вопросы, уже распарсенные weight/invert_multiplier,
+    индексы колонок и общую таблицу (qid, token) -> (индекс вопроса, potential_id),
+    чтобы score_blocks делал только поиск в словарях и сложения.
+    Токены в таблице уже приведены через _fold: id, opt_*, русские имена
+    потенциалов и тексты вариантов находятся одним поиском.
     """
 
-    answers_map = _safe_get_answers_map(answers_json)
-    questions = _all_questions(blocks_json)
+    version: Optional[str]
+    questions: Tuple[Dict[str, Any], ...]
+    items: Tuple[CompiledQuestion, ...]
+    item_index: Dict[str, int]
+    column_index: Dict[str, int]
+    lookup: Dict[Tuple[str, str], Tuple[int, str]]
+
+    def resolve(self, qid: str, token: str) -> Optional[Tuple[int, str]]:
+        # как исторически в score_blocks: префикс opt_ снимается до поиска
+        return self.lookup.get((qid, _normalize_token(token)))
 
-    # создаём контейнеры скоринга
-    scores: Dict[str, PotentialScore] = {pid: PotentialScore() for pid in POTENTIAL_IDS}
+
+@timed("scoring.compile")
+def compile_questionnaire(blocks_json: Dict[str, Any]) -> CompiledQuestionnaire:
+    questions = _all_questions(blocks_json)
 
     # общий множитель штрафа (можно переопределять в вопросе)
     default_invert_multiplier = 1.0
 
-    # 1) собираем баллы
+    items: List[CompiledQuestion] = []
+    lookup: Dict[Tuple[str, str], Tuple[int, str]] = {}
+    names = _potential_names(blocks_json)
+
     for q in questions:
-        qid = q.get("id")
+        qid = str(q.get("id"))
         col = (q.get("column") or "").strip().lower()
 
         if col not in COLUMNS:
-            # если вдруг колонка не задана — пропускаем
+            # если вдруг колонка не задана — вопрос в скоринге не участвует
             continue
 
         weight = q.get("weight", 1.0)
@@ -209,82 +388,564 @@ def score_blocks(blocks_json: Dict[str, Any], answers_json: Dict[str, Any]) -> D
         except Exception:
             inv_mul = default_invert_multiplier
 
+        qi = len(items)
+        option_map = _build_q_option_map(q)
+        offered = sorted({POTENTIAL_INDEX[pid] for pid in option_map.values() if pid in POTENTIAL_INDEX})
+        items.append(
+            CompiledQuestion(
+                qid=qid,
+                column=col,
+                weight=w,
+                invert=invert,
+                invert_multiplier=inv_mul,
+                delta=w * inv_mul if invert else w,
+                slot=COLUMNS.index(col) * 2 + (1 if invert else 0),
+                # без вариантов в опроснике ответом может быть любой потенциал
+                options=tuple(offered) if offered else tuple(range(len(POTENTIAL_IDS))),
+            )
+        )
+
+        # сначала — любой потенциальный id и его имя (как запасной вариант),
+        # потом опции вопроса, чтобы они имели приоритет
+        for pid in POTENTIAL_IDS:
+            lookup[(qid, pid)] = (qi, pid)
+        for name, pid in names.items():
+            lookup[(qid, name)] = (qi, pid)
+        for token, pid in option_map.items():
+            if pid in POTENTIAL_IDS:
+                lookup[(qid, token)] = (qi, pid)
+
+    return CompiledQuestionnaire(
+        version=str(blocks_json["version"]) if blocks_json.get("version") is not None else None,
+        questions=tuple(questions),
+        items=tuple(items),
+        item_index={item.qid: i for i, item in enumerate(items)},
+        column_index={c: i for i, c in enumerate(COLUMNS)},
+        lookup=lookup,
+    )
+
+
+def _as_compiled(blocks_json: Union[Dict[str, Any], CompiledQuestionnaire]) -> CompiledQuestionnaire:
+    if isinstance(blocks_json, CompiledQuestionnaire):
+        return blocks_json
+    return compile_questionnaire(blocks_json)
+
+
+def score_compact(
+    blocks_json: Union[Dict[str, Any], CompiledQuestionnaire],
+    answers_json: Dict[str, Any],
+) -> CompactReport:
+    """
+    То же, что score_blocks, но без сборки словаря report.json:
+    удобно держать в памяти тысячи результатов для когортного анализа.
+    """
+    compiled = _as_compiled(blocks_json)
+    answers_map = _safe_get_answers_map(answers_json)
+
+    # плоский массив potential × column × [pos, neg]
+    stride = len(COLUMNS) * 2
+    acc = [0.0] * (len(POTENTIAL_IDS) * stride)
+
+    # 1) собираем баллы
+    for item in compiled.items:
         # достаём ответ
-        raw_answer = answers_map.get(qid)
+        raw_answer = answers_map.get(item.qid)
 
         # иногда текстовые поля идут как b1_q12_text — игнорируем для скоринга
         if raw_answer is None:
             continue
 
-        tokens = _extract_all_selected(raw_answer)
-        if not tokens:
-            continue
+        for pi, count in _selection_counts(compiled, item.qid, raw_answer).items():
+            # для invert_score вопросов slot указывает на neg:
+            # чем чаще человек выбирает это как “через силу/откладываю”, тем больше минус
+            acc[pi * stride + item.slot] += count * item.delta
 
-        opt_map = _build_q_option_map(q)
+    # 2) “матрица 3х3” по колонкам считается в matrix_rows
+    # Важно: РЯД 3 (слабости) даём только если реально есть neg в этой колонке.
+    values = np.array(acc, dtype=np.float64).reshape(len(POTENTIAL_IDS), len(COLUMNS), 2)
+    return CompactReport.from_values(values)
 
-        for t in tokens:
-            norm = _normalize_token(t)
 
-            # 1) прямое попадание в opt_map
-            pid = opt_map.get(norm)
+@timed("scoring.score_blocks")
+def score_blocks(
+    blocks_json: Union[Dict[str, Any], CompiledQuestionnaire],
+    answers_json: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Главная функция для Streamlit.
+    blocks_json — сырой neo_blocks.json или уже готовый CompiledQuestionnaire
+    (его выгодно собрать один раз и переиспользовать при массовом пересчёте).
+    Возвращает report.json со структурой:
+    {
+      "scores": {
+        "citrine": {"strength": ..., "by_column": {...}, "pos":..., "neg":...},
+        ...
+      },
+      "matrix": {
+         "perception": {"row1": "...", "row2": "...", "row3": "..."},
+         ...
+      }
+    }
+    """
+    return score_compact(blocks_json, answers_json).to_report()
 
-            # 2) если не нашли, но это выглядит как потенциальный id
-            if not pid and norm in POTENTIAL_IDS:
-                pid = norm
 
-            if not pid or pid not in scores:
+class IncrementalScorer:
+    """
+    Пошаговый скоринг для мастера-визарда.
+
+    Хранит вклад каждого вопроса отдельно: set_answer() снимает старый вклад
+    вопроса и добавляет новый, трогая только затронутые ячейки. Ячейки
+    пересчитываются в порядке вопросов, поэтому результат побитово совпадает
+    с score_blocks по тем же ответам, а финальный report() ничего не пересчитывает.
+    """
+
+    def __init__(self, blocks_json: Union[Dict[str, Any], CompiledQuestionnaire]):
+        self.compiled = _as_compiled(blocks_json)
+        self._stride = len(COLUMNS) * 2
+        self._acc = [0.0] * (len(POTENTIAL_IDS) * self._stride)
+        # qid -> [(индекс ячейки, count * delta), ...] по одной записи на потенциал
+        self._contrib: Dict[str, List[Tuple[int, float]]] = {}
+
+    def _contributions(self, qid: str, raw_answer: Any) -> List[Tuple[int, float]]:
+        qi = self.compiled.item_index.get(qid)
+        if qi is None or raw_answer is None:
+            return []
+        item = self.compiled.items[qi]
+        return [
+            (pi * self._stride + item.slot, count * item.delta)
+            for pi, count in _selection_counts(self.compiled, qid, raw_answer).items()
+        ]
+
+    def _recompute(self, cell: int):
+        total = 0.0
+        for item in self.compiled.items:
+            for idx, d in self._contrib.get(item.qid, ()):
+                if idx == cell:
+                    total += d
+        self._acc[cell] = total
+
+    @timed("scoring.set_answer")
+    def set_answer(self, qid: str, raw_answer: Any) -> bool:
+        """
+        Применяет (или снимает, если raw_answer=None) ответ на один вопрос.
+        Возвращает True, если скоринг изменился.
+        """
+        new = self._contributions(qid, raw_answer)
+        old = self._contrib.get(qid, [])
+        if new == old:
+            return False
+
+        if new:
+            self._contrib[qid] = new
+        else:
+            self._contrib.pop(qid, None)
+
+        for cell in {idx for idx, _ in old} | {idx for idx, _ in new}:
+            self._recompute(cell)
+        return True
+
+    def answered(self) -> int:
+        # сколько вопросов уже дали вклад в скоринг
+        return len(self._contrib)
+
+    def compact(self) -> CompactReport:
+        values = np.array(self._acc, dtype=np.float64).reshape(len(POTENTIAL_IDS), len(COLUMNS), 2)
+        return CompactReport.from_values(values)
+
+    def matrix(self) -> Dict[str, Dict[str, Optional[str]]]:
+        # промежуточная матрица на текущем шаге
+        return self.compact().matrix()
+
+    def report(self) -> Dict[str, Any]:
+        return self.compact().to_report()
+
+    def next_question(self, order: List[str], visited: Iterable[str], reorder: bool = False) -> Optional[str]:
+        """
+        Адаптивный режим: следующий вопрос из order, который ещё может
+        изменить матрицу (его колонка зафиксирована не полностью).
+        Вопросы вне скоринга не пропускаем. None — дальше спрашивать незачем.
+        reorder=True — сначала вопрос, чьи варианты затрагивают больше
+        потенциалов, которые ещё могут попасть в row1/row2 своей колонки.
+        """
+        visited = set(visited)
+        remaining = [qid for qid in order if qid not in visited]
+        if not remaining:
+            return None
+
+        values = self.compact().values
+        pos_gain, neg_gain = remaining_gains(self.compiled, remaining)
+        locked = locked_rows(values, pos_gain, neg_gain)
+        open_cols = ~locked.all(axis=1)
+
+        candidates = []
+        for qid in remaining:
+            qi = self.compiled.item_index.get(qid)
+            if qi is None:
+                # вне скоринга — спрашиваем на своём месте
+                if not candidates:
+                    return qid
                 continue
+            if open_cols[self.compiled.column_index[self.compiled.items[qi].column]]:
+                if not reorder:
+                    return qid
+                candidates.append(qi)
+        if not candidates:
+            return None
+
+        # «ещё в игре»: лучший случай не ниже худшего случая текущего row2
+        eff = values[:, :, 0] - (values[:, :, 1] * 1.0)
+        rows = matrix_rows(values[None, :, :, 0], values[None, :, :, 1])[0]
+        in_play = np.zeros_like(eff, dtype=bool)
+        for ci in range(len(COLUMNS)):
+            b = int(rows[ci, 1])
+            in_play[:, ci] = eff[:, ci] + pos_gain[:, ci] >= eff[b, ci] - neg_gain[b, ci]
+
+        def info(qi: int) -> int:
+            item = self.compiled.items[qi]
+            ci = self.compiled.column_index[item.column]
+            return sum(1 for pi in item.options if in_play[pi, ci])
+
+        best = max(candidates, key=info)  # max берёт первый при равенстве — порядок order
+        return self.compiled.items[best].qid
+
+
+# =========================
+#  Адаптивный режим: когда матрица уже не изменится
+# =========================
+def remaining_gains(compiled: CompiledQuestionnaire, remaining: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Сколько ещё максимум может добавиться каждому потенциалу в каждой
+    колонке от оставшихся вопросов: (pos_gain, neg_gain), оба 9×3.
+    Граница верхняя: считаем, что каждый вопрос может отдать свой delta
+    любому из своих вариантов.
+    """
+    pos_gain = np.zeros((len(POTENTIAL_IDS), len(COLUMNS)), dtype=np.float64)
+    neg_gain = np.zeros_like(pos_gain)
+    for qid in remaining:
+        qi = compiled.item_index.get(qid)
+        if qi is None:
+            continue
+        item = compiled.items[qi]
+        target = neg_gain if item.invert else pos_gain
+        ci = compiled.column_index[item.column]
+        for pi in item.options:
+            target[pi, ci] += item.delta
+    return pos_gain, neg_gain
 
-            if invert:
-                # чем чаще человек выбирает это как “через силу/откладываю”, тем больше минус
-                scores[pid].add_neg(col, w * inv_mul)
-            else:
-                scores[pid].add_pos(col, w)
 
-    # 2) формируем “матрицу 3х3” по колонкам
-    # Важно: РЯД 3 (слабости) даём только если реально есть neg в этой колонке.
-    matrix: Dict[str, Dict[str, Optional[str]]] = {c: {"row1": None, "row2": None, "row3": None} for c in COLUMNS}
+def _beats(a_score: float, b_score: float, a: int, b: int) -> bool:
+    # a стоит выше b в стабильной сортировке по убыванию (при равенстве — порядок POTENTIAL_IDS)
+    return a_score > b_score or (a_score == b_score and a < b)
 
-    for col in COLUMNS:
-        # считаем эффективность
-        eff: List[Tuple[str, float, float]] = []  # (pid, effective, neg)
-        for pid in POTENTIAL_IDS:
-            neg_val = scores[pid].neg.get(col, 0.0)
-            eff_val = scores[pid].effective(col, invert_multiplier=1.0)
-            eff.append((pid, eff_val, neg_val))
-
-        # row1 и row2 — по effective
-        eff_sorted = sorted(eff, key=lambda x: x[1], reverse=True)
-        row1 = eff_sorted[0][0] if eff_sorted else None
-        row2 = eff_sorted[1][0] if len(eff_sorted) > 1 else None
-
-        # row3 — ТОЛЬКО если есть отрицательные маркеры
-        # берём того, у кого neg максимальный (если равны — кто хуже по effective)
-        any_neg = any(n > 0 for _, _, n in eff)
-        if any_neg:
-            row3 = sorted(eff, key=lambda x: (x[2], -x[1]), reverse=True)[0][0]
+
+def locked_rows(values: np.ndarray, pos_gain: np.ndarray, neg_gain: np.ndarray) -> np.ndarray:
+    """
+    3×3 (column × row1..row3): True, если ячейку матрицы уже не изменит
+    никакой набор оставшихся ответов. Правила — те же, что в matrix_rows.
+    """
+    pos = values[:, :, 0]
+    neg = values[:, :, 1]
+    eff = pos - (neg * 1.0)
+    rows = matrix_rows(pos[None], neg[None])[0]
+    eff_max = eff + pos_gain  # лучший случай для потенциала
+    eff_min = eff - neg_gain  # худший случай
+    n_p = len(POTENTIAL_IDS)
+
+    locked = np.zeros((len(COLUMNS), len(ROWS)), dtype=bool)
+    for ci in range(len(COLUMNS)):
+        a, b = int(rows[ci, 0]), int(rows[ci, 1])
+        # row1: лидер в худшем случае выше всех остальных в их лучшем
+        locked[ci, 0] = all(_beats(eff_min[a, ci], eff_max[x, ci], a, x) for x in range(n_p) if x != a)
+        # row2: второй выше всех, кроме лидера (и лидер зафиксирован)
+        locked[ci, 1] = locked[ci, 0] and all(
+            _beats(eff_min[b, ci], eff_max[x, ci], b, x) for x in range(n_p) if x not in (a, b)
+        )
+
+        w = int(rows[ci, 2])
+        if w < 0:
+            # слабости нет; появится, только если остались вопросы с invert_score
+            locked[ci, 2] = not neg_gain[:, ci].any()
         else:
-            row3 = None  # нет “слабости” по этой колонке
-
-        matrix[col]["row1"] = row1
-        matrix[col]["row2"] = row2
-        matrix[col]["row3"] = row3
-
-    # 3) собираем общий словарь scores для report.json
-    out_scores: Dict[str, Any] = {}
-    for pid in POTENTIAL_IDS:
-        by_col = {c: scores[pid].effective(c, invert_multiplier=1.0) for c in COLUMNS}
-        out_scores[pid] = {
-            "strength": float(sum(by_col.values())),
-            "by_column": by_col,
-            "pos": scores[pid].pos,
-            "neg": scores[pid].neg,
+            # neg только растёт: w держится, если его уже никто не догонит
+            ok = True
+            for x in range(n_p):
+                if x == w:
+                    continue
+                neg_x_max = neg[x, ci] + neg_gain[x, ci]
+                if neg[w, ci] > neg_x_max:
+                    continue
+                if neg_gain[x, ci] == 0 and neg[w, ci] == neg[x, ci]:
+                    # при равном neg побеждает меньший effective
+                    if _beats(-eff_max[w, ci], -eff_min[x, ci], w, x):
+                        continue
+                ok = False
+                break
+            locked[ci, 2] = ok
+    return locked
+
+
+# =========================
+#  Пакетный (векторный) скоринг
+# =========================
+def encode_answers(compiled: CompiledQuestionnaire, answers_list: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Кодирует ответы в тензор respondents × questions × potentials:
+    сколько раз потенциал выбран в вопросе (обычно 0/1).
+    Индекс вопроса — позиция в compiled.items.
+
+    В Python остаётся только разбор ответов в плоский список ячеек
+    (вопрос, потенциал); номера респондентов и сам тензор собираются
+    numpy одним проходом (np.repeat + np.bincount).
+    """
+    n_r = len(answers_list)
+    n_q = len(compiled.items)
+    n_p = len(POTENTIAL_IDS)
+    item_index = compiled.item_index
+    resolve = compiled.resolve
+
+    # (qid, токен) -> ячейка qi * n_p + pi, -1 — не распознан. Одни и те же
+    # токены повторяются у тысяч респондентов: fold и поиск — раз на пачку
+    cells: Dict[Tuple[str, str], int] = {}
+    flat: List[int] = []  # ячейки всех выборов пачки подряд
+    per_resp: List[int] = []  # сколько из них у каждого респондента
+    tokens: List[str] = []
+
+    for answers_json in answers_list:
+        start = len(flat)
+        for qid, raw_answer in _safe_get_answers_map(answers_json).items():
+            if raw_answer is None or qid not in item_index:
+                continue
+            tokens.clear()
+            _collect_selected(raw_answer, tokens)
+            for t in tokens:
+                cell = cells.get((qid, t))
+                if cell is None:
+                    hit = resolve(qid, t)
+                    cell = cells[(qid, t)] = -1 if hit is None else hit[0] * n_p + POTENTIAL_INDEX[hit[1]]
+                flat.append(cell)
+        per_resp.append(len(flat) - start)
+
+    cell_arr = np.fromiter(flat, dtype=np.int64, count=len(flat))
+    resp = np.repeat(np.arange(n_r, dtype=np.int64), per_resp)
+    known = cell_arr >= 0
+    counts = np.bincount(resp[known] * (n_q * n_p) + cell_arr[known], minlength=n_r * n_q * n_p)
+    return counts.reshape(n_r, n_q, n_p)
+
+
+def score_counts(
+    compiled: CompiledQuestionnaire,
+    counts: np.ndarray,
+    deltas: Optional[np.ndarray] = None,
+    inverts: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    По тензору выборов считает pos/neg формы respondents × potentials × columns.
+
+    deltas/inverts позволяют подменить веса вопросов без пересборки опросника.
+    Вопросы складываются по одному в порядке order — так суммы побитово
+    совпадают с score_blocks.
+    """
+    n_r = counts.shape[0]
+    shape = (n_r, len(POTENTIAL_IDS), len(COLUMNS))
+    pos = np.zeros(shape, dtype=np.float64)
+    neg = np.zeros(shape, dtype=np.float64)
+
+    for qi, item in enumerate(compiled.items):
+        d = item.delta if deltas is None else float(deltas[qi])
+        inv = item.invert if inverts is None else bool(inverts[qi])
+        target = neg if inv else pos
+        ci = compiled.column_index[item.column]
+        target[:, :, ci] += counts[:, qi, :] * d
+
+    return pos, neg
+
+
+def matrix_rows(pos: np.ndarray, neg: np.ndarray) -> np.ndarray:
+    """
+    Векторная версия выбора row1/row2/row3.
+    Возвращает индексы потенциалов формы respondents × columns × 3 (-1 = нет).
+    Порядок при равенстве — как у sorted() в score_blocks (по POTENTIAL_IDS).
+    """
+    eff = pos - (neg * 1.0)
+
+    # row1 и row2 — по effective (стабильная сортировка по убыванию)
+    order = np.argsort(-eff, axis=1, kind="stable")
+
+    # row3 — max neg, при равенстве — меньший effective
+    weak = np.lexsort((eff, -neg), axis=1)[:, 0, :]
+    any_neg = (neg > 0).any(axis=1)
+
+    rows = np.empty((pos.shape[0], pos.shape[2], 3), dtype=np.int64)
+    rows[:, :, 0] = order[:, 0, :]
+    rows[:, :, 1] = order[:, 1, :]
+    rows[:, :, 2] = np.where(any_neg, weak, -1)
+    return rows
+
+
+@dataclass(frozen=True)
+class SparseCounts:
+    """
+    Ненулевые элементы тензора encode_answers: у респондента ~один выбор
+    на вопрос, поэтому хранить весь respondents × questions × potentials
+    незачем. Элементы одного респондента идут подряд по возрастанию вопроса.
+    """
+
+    n: int
+    resp: np.ndarray  # int32, индекс респондента
+    question: np.ndarray  # int16, позиция в compiled.items
+    potential: np.ndarray  # int8, индекс в POTENTIAL_IDS
+    count: np.ndarray  # int16, сколько раз выбран
+
+    @classmethod
+    def from_counts(cls, counts: np.ndarray) -> "SparseCounts":
+        r, q, p = np.nonzero(counts)  # C-порядок: по респонденту, затем по вопросу
+        return cls(
+            n=counts.shape[0],
+            resp=r.astype(np.int32),
+            question=q.astype(np.int16),
+            potential=p.astype(np.int8),
+            count=counts[r, q, p].astype(np.int16),
+        )
+
+
+def score_sparse(
+    compiled: CompiledQuestionnaire,
+    sparse: SparseCounts,
+    deltas: Optional[np.ndarray] = None,
+    inverts: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    То же, что score_counts, но по SparseCounts и одним np.bincount:
+    каждый выбор попадает в ячейку (респондент, потенциал, колонка, pos/neg).
+    bincount складывает по порядку элементов, т. е. по вопросам —
+    суммы побитово совпадают с score_counts.
+    """
+    items = compiled.items
+    if deltas is None:
+        deltas = np.array([item.delta for item in items], dtype=np.float64)
+    if inverts is None:
+        inverts = np.array([item.invert for item in items], dtype=bool)
+    col = np.array([compiled.column_index[item.column] for item in items], dtype=np.int64)
+    slot = col * 2 + np.asarray(inverts, dtype=np.int64)
+
+    q = sparse.question.astype(np.int64)
+    n_p, n_c = len(POTENTIAL_IDS), len(COLUMNS)
+    cell = (sparse.resp.astype(np.int64) * n_p + sparse.potential) * (n_c * 2) + slot[q]
+    weights = sparse.count * np.asarray(deltas, dtype=np.float64)[q]
+
+    out = np.bincount(cell, weights=weights, minlength=sparse.n * n_p * n_c * 2)
+    out = out.reshape(sparse.n, n_p, n_c, 2)
+    return out[..., 0], out[..., 1]
+
+
+def iter_score_compact(
+    blocks_json: Union[Dict[str, Any], CompiledQuestionnaire],
+    answers_iterable: Iterable[Dict[str, Any]],
+    chunk_size: int = 4096,
+) -> Iterator[CompactReport]:
+    """
+    Потоковый пакетный скоринг: читает ответы пачками по chunk_size,
+    поэтому память не растёт с размером архива.
+    """
+    compiled = _as_compiled(blocks_json)
+    it = iter(answers_iterable)
+
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+
+        values, rows = _score_chunk(compiled, chunk)
+        rows = rows.astype(np.int8)
+
+        # копии, чтобы отдельный результат не держал в памяти всю пачку
+        for i in range(len(chunk)):
+            yield CompactReport(values[i].copy(), rows[i].copy())
+
+
+def _score_chunk(compiled: CompiledQuestionnaire, chunk: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    # values (N, 9, 3, 2) и rows (N, 3, 3) для пачки ответов
+    counts = encode_answers(compiled, chunk)
+    pos, neg = score_counts(compiled, counts)
+    return np.stack((pos, neg), axis=-1), matrix_rows(pos, neg)
+
+
+def iter_score_many(
+    blocks_json: Union[Dict[str, Any], CompiledQuestionnaire],
+    answers_iterable: Iterable[Dict[str, Any]],
+    chunk_size: int = 4096,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Потоковый вариант score_many. Словари собираются прямо из массивов
+    пачки, без промежуточных CompactReport.
+    """
+    compiled = _as_compiled(blocks_json)
+    it = iter(answers_iterable)
+
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+
+        values, rows = _score_chunk(compiled, chunk)
+        yield from _report_dicts(values, rows)
+
+
+def _report_dicts(values: np.ndarray, rows: np.ndarray) -> Iterator[Dict[str, Any]]:
+    """
+    report.json для каждого респондента пачки: values (N, 9, 3, 2), rows (N, 3, 3).
+    effective и strength считаются numpy на всю пачку в том же порядке
+    операций, что CompactReport.to_report, а в списки переводятся плоские
+    (N, 27) массивы — словари собираются из их элементов.
+    """
+    n = values.shape[0]
+    pos = values[..., 0]
+    neg = values[..., 1]
+    eff = pos - (neg * 1.0)
+    c0, c1, c2 = COLUMNS
+    strength = eff[..., 0] + eff[..., 1] + eff[..., 2]  # как sum() по колонкам
+
+    names = [None] + POTENTIAL_IDS  # индекс потенциала + 1, -1 -> None
+    r0, r1, r2 = ROWS
+    spans = [(pid, i, i * 3) for i, pid in enumerate(POTENTIAL_IDS)]
+
+    for p, ng, e, s, r in zip(
+        pos.reshape(n, -1).tolist(),
+        neg.reshape(n, -1).tolist(),
+        eff.reshape(n, -1).tolist(),
+        strength.tolist(),
+        (rows.reshape(n, -1) + 1).tolist(),
+    ):
+        yield {
+            "scores": {
+                pid: {
+                    "strength": s[i],
+                    "by_column": {c0: e[a], c1: e[a + 1], c2: e[a + 2]},
+                    "pos": {c0: p[a], c1: p[a + 1], c2: p[a + 2]},
+                    "neg": {c0: ng[a], c1: ng[a + 1], c2: ng[a + 2]},
+                }
+                for pid, i, a in spans
+            },
+            "matrix": {
+                c0: {r0: names[r[0]], r1: names[r[1]], r2: names[r[2]]},
+                c1: {r0: names[r[3]], r1: names[r[4]], r2: names[r[5]]},
+                c2: {r0: names[r[6]], r1: names[r[7]], r2: names[r[8]]},
+            },
+            "meta": {
+                "note": REPORT_NOTE,
+            },
         }
 
-    return {
-        "scores": out_scores,
-        "matrix": matrix,
-        "meta": {
-            "note": "Row3 (weakness) is assigned only if invert_score evidence exists in that column.",
-        },
-    }
\ No newline at end of file
+
+@timed("scoring.score_many")
+def score_many(
+    blocks_json: Union[Dict[str, Any], CompiledQuestionnaire],
+    answers_iterable: Iterable[Dict[str, Any]],
+    chunk_size: int = 4096,
+) -> List[Dict[str, Any]]:
+    """
+    Скоринг сразу многих респондентов.
+    Результат для каждого совпадает с score_blocks(blocks_json, answers).
+    """
+    return list(iter_score_many(blocks_json, answers_iterable, chunk_size=chunk_size))
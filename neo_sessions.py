@@ -0,0 +1,302 @@
+# neo_sessions.py
+"""
+Где живёт незавершённая сессия визарда (respondent, answers, step).
+
+st.session_state есть только в памяти одного процесса, поэтому
+состояние дублируется в хранилище по client_id: любой процесс
+(реплика за балансировщиком, перезапущенный воркер) поднимает сессию
+по ?client=...&token=... из адреса. token — случайная строка,
+выданная на старте и хранящаяся вместе с сессией: client_id
+угадывается (<имя>-<unix ts>), token — нет.
+
+Бэкенд выбирается переменными окружения:
+    NEO_SESSION_BACKEND=file    (по умолчанию) журнал answers.jsonl в папке клиента
+    NEO_SESSION_BACKEND=sqlite  NEO_SESSION_URL=data/sessions.sqlite3
+    NEO_SESSION_BACKEND=redis   NEO_SESSION_URL=redis://host:6379/0  (нужен pip install redis)
+
+Для file и sqlite папка data/ должна быть общей для всех реплик.
+После «Завершить» ответы переезжают в responses.json, а сессия удаляется.
+"""
+from __future__ import annotations
+
+import abc
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import neo_storage
+from neo_metrics import timed
+
+try:
+    import redis
+except Exception:  # redis — необязательная зависимость
+    redis = None
+
+
+SESSION_TTL_SECONDS = 30 * 24 * 3600
+SQLITE_PATH = os.path.join(neo_storage.DATA_DIR, "sessions.sqlite3")
+SESSION_FILE = "session.json"
+
+
+@dataclass
+class WizardState:
+    respondent: Dict[str, Any]
+    answers: Dict[str, Any]
+    step: int = 0
+    token: str = ""
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def token_matches(state: Optional[WizardState], token: Any) -> bool:
+    # сессии без токена (начатые до его появления) продолжить нельзя
+    return (
+        state is not None
+        and bool(state.token)
+        and isinstance(token, str)
+        and hmac.compare_digest(state.token.encode("utf-8"), token.encode("utf-8"))
+    )
+
+
+class SessionStore(abc.ABC):
+    """
+    Интерфейс хранилища. Каждый клик — одна маленькая запись
+    (record_answer), а не сохранение всего состояния.
+    """
+
+    @abc.abstractmethod
+    def start(self, respondent: Dict[str, Any], token: str):
+        ...
+
+    @abc.abstractmethod
+    def record_answer(self, client_id: str, qid: str, answer: Any, step: int):
+        ...
+
+    @abc.abstractmethod
+    def load(self, client_id: str) -> Optional[WizardState]:
+        """None — сессии нет или тест уже завершён."""
+
+    @abc.abstractmethod
+    def delete(self, client_id: str):
+        ...
+
+    def finish(self, client_id: str, respondent: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Переносит ответы в responses.json, удаляет сессию
+        и возвращает payload responses.json.
+        """
+        state = self.load(client_id)
+        payload = neo_storage.write_responses(client_id, respondent, state.answers if state else {})
+        self.delete(client_id)
+        return payload
+
+
+def _is_finished(client_id: str) -> bool:
+    return os.path.exists(os.path.join(neo_storage.client_dir(client_id), "responses.json"))
+
+
+class FileSessionStore(SessionStore):
+    """
+    Журнал answers.jsonl + profile.json в папке клиента (как раньше),
+    токен — в session.json рядом.
+    """
+
+    def _token_path(self, client_id: str) -> str:
+        return os.path.join(neo_storage.client_dir(client_id), SESSION_FILE)
+
+    def start(self, respondent: Dict[str, Any], token: str):
+        # profile.json визард пишет сам; журнал появится с первым ответом
+        neo_storage.save_json(self._token_path(respondent["client_id"]), {"token": token, "started_at": int(time.time())})
+
+    @timed("sessions.record_answer")
+    def record_answer(self, client_id: str, qid: str, answer: Any, step: int):
+        neo_storage.append_answer(client_id, qid, answer, step)
+
+    def load(self, client_id: str) -> Optional[WizardState]:
+        profile = neo_storage.safe_read_json(os.path.join(neo_storage.client_dir(client_id), "profile.json"))
+        if not isinstance(profile, dict) or _is_finished(client_id):
+            return None
+        session = neo_storage.safe_read_json(self._token_path(client_id))
+        token = str(session.get("token") or "") if isinstance(session, dict) else ""
+        answers, step = neo_storage.read_journal(client_id)
+        return WizardState(respondent=profile, answers=answers, step=step, token=token)
+
+    def delete(self, client_id: str):
+        for path in (neo_storage.journal_path(client_id), self._token_path(client_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def finish(self, client_id: str, respondent: Dict[str, Any]) -> Dict[str, Any]:
+        payload = neo_storage.compact_journal(client_id, respondent)
+        self.delete(client_id)
+        return payload
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    client_id  TEXT PRIMARY KEY,
+    respondent TEXT NOT NULL,
+    step       INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0,
+    token      TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS session_answers (
+    client_id TEXT NOT NULL,
+    qid       TEXT NOT NULL,
+    answer    TEXT,
+    PRIMARY KEY (client_id, qid)
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Одна строка на сессию + строка на ответ: клик — UPSERT одного ответа.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SQLITE_SCHEMA)
+                    cols = {r[1] for r in conn.execute("PRAGMA table_info(sessions)")}
+                    if "token" not in cols:
+                        # база создана до появления токенов
+                        conn.execute("ALTER TABLE sessions ADD COLUMN token TEXT NOT NULL DEFAULT ''")
+                    self._schema_ready = True
+        return conn
+
+    def start(self, respondent: Dict[str, Any], token: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (client_id, respondent, step, updated_at, token) VALUES (?, ?, 0, ?, ?)",
+                (respondent["client_id"], json.dumps(respondent, ensure_ascii=False), time.time(), token),
+            )
+
+    @timed("sessions.record_answer")
+    def record_answer(self, client_id: str, qid: str, answer: Any, step: int):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_answers (client_id, qid, answer) VALUES (?, ?, ?)",
+                (client_id, qid, json.dumps(answer, ensure_ascii=False)),
+            )
+            conn.execute(
+                "UPDATE sessions SET step = ?, updated_at = ? WHERE client_id = ?",
+                (int(step), time.time(), client_id),
+            )
+
+    def load(self, client_id: str) -> Optional[WizardState]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT respondent, step, token FROM sessions WHERE client_id = ?", (client_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            answers = {
+                qid: json.loads(answer) if answer is not None else None
+                for qid, answer in conn.execute(
+                    "SELECT qid, answer FROM session_answers WHERE client_id = ?", (client_id,)
+                )
+            }
+        return WizardState(respondent=json.loads(row[0]), answers=answers, step=int(row[1]), token=row[2] or "")
+
+    def delete(self, client_id: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM session_answers WHERE client_id = ?", (client_id,))
+            conn.execute("DELETE FROM sessions WHERE client_id = ?", (client_id,))
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Хэш neo:session:<client_id>: поля respondent, step, token и a:<qid> на ответ.
+    Ключ живёт SESSION_TTL_SECONDS с последнего клика.
+    """
+
+    PREFIX = "neo:session:"
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("Для NEO_SESSION_BACKEND=redis нужен пакет redis (pip install redis)")
+        self.r = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, client_id: str) -> str:
+        return self.PREFIX + client_id
+
+    def start(self, respondent: Dict[str, Any], token: str):
+        key = self._key(respondent["client_id"])
+        pipe = self.r.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={"respondent": json.dumps(respondent, ensure_ascii=False), "step": 0, "token": token})
+        pipe.expire(key, SESSION_TTL_SECONDS)
+        pipe.execute()
+
+    @timed("sessions.record_answer")
+    def record_answer(self, client_id: str, qid: str, answer: Any, step: int):
+        key = self._key(client_id)
+        pipe = self.r.pipeline()
+        pipe.hset(key, mapping={f"a:{qid}": json.dumps(answer, ensure_ascii=False), "step": int(step)})
+        pipe.expire(key, SESSION_TTL_SECONDS)
+        pipe.execute()
+
+    def load(self, client_id: str) -> Optional[WizardState]:
+        data = self.r.hgetall(self._key(client_id))
+        if not data or "respondent" not in data:
+            return None
+        answers = {k[2:]: json.loads(v) for k, v in data.items() if k.startswith("a:")}
+        return WizardState(
+            respondent=json.loads(data["respondent"]),
+            answers=answers,
+            step=int(data.get("step") or 0),
+            token=data.get("token") or "",
+        )
+
+    def delete(self, client_id: str):
+        self.r.delete(self._key(client_id))
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def make_store(backend: Optional[str] = None, url: Optional[str] = None) -> SessionStore:
+    backend = (backend or os.environ.get("NEO_SESSION_BACKEND") or "file").strip().lower()
+    url = url or os.environ.get("NEO_SESSION_URL") or None
+    if backend == "file":
+        return FileSessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(url or SQLITE_PATH)
+    if backend == "redis":
+        return RedisSessionStore(url or "redis://localhost:6379/0")
+    raise ValueError(f"Неизвестный NEO_SESSION_BACKEND: {backend!r} (file / sqlite / redis)")
+
+
+def get_store() -> SessionStore:
+    """
+    Хранилище сессий процесса (создаётся один раз по переменным окружения).
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = make_store()
+    return _store
@@ -0,0 +1,805 @@
+# neo_storage.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from neo_metrics import timed
+from neo_scoring import _safe_get_answers_map, answers_error, score_blocks
+
+if TYPE_CHECKING:
+    from neo_questionnaire import Questionnaire
+
+
+DATA_DIR = "data"
+CLIENTS_DIR = os.path.join(DATA_DIR, "clients")  # data/clients/<shard>/<client_id>/
+# маркер «старых плоских папок data/clients/<client_id> не осталось»
+LAYOUT_MARKER = os.path.join(CLIENTS_DIR, ".sharded")
+INDEX_PATH = os.path.join(DATA_DIR, "clients_index.sqlite3")
+
+# статусы отчёта в индексе
+REPORT_NONE = "none"
+REPORT_DONE = "done"
+REPORT_PENDING = "pending"  # ответы сохранены, отчёт ждёт в очереди (neo_queue)
+REPORT_FAILED = "failed"  # очередь исчерпала попытки, причина — jobs.last_error
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    client_id     TEXT PRIMARY KEY,
+    name          TEXT NOT NULL DEFAULT '',
+    name_key      TEXT NOT NULL DEFAULT '',
+    phone         TEXT NOT NULL DEFAULT '',
+    phone_key     TEXT NOT NULL DEFAULT '',
+    created_at    INTEGER NOT NULL DEFAULT 0,
+    report_status TEXT NOT NULL DEFAULT 'none',
+    updated_at    REAL NOT NULL DEFAULT 0,
+    change_seq    INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS clients_name_key ON clients (name_key, client_id);
+CREATE INDEX IF NOT EXISTS clients_phone_key ON clients (phone_key);
+CREATE INDEX IF NOT EXISTS clients_created_at ON clients (created_at);
+CREATE INDEX IF NOT EXISTS clients_report_status ON clients (report_status);
+CREATE INDEX IF NOT EXISTS clients_updated_at ON clients (updated_at);
+CREATE TABLE IF NOT EXISTS jobs (
+    client_id   TEXT PRIMARY KEY,
+    enqueued_at REAL NOT NULL,
+    claimed_at  REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT,
+    not_before  REAL NOT NULL DEFAULT 0,
+    failed_at   REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_enqueued_at ON jobs (enqueued_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# метка в meta: папки data/clients уже один раз перенесены в индекс
+BACKFILL_KEY = "backfilled_at"
+
+# сквозной номер изменения клиента для инкрементальных читателей (changed_since).
+# updated_at — часы писателя до коммита: параллельный писатель может закоммитить
+# строку с меньшим updated_at уже после того, как читатель сдвинул watermark.
+# Номер выдаётся триггером внутри транзакции записи, а писатели в SQLite
+# идут по одному, поэтому порядок номеров — порядок коммитов.
+_CHANGE_SEQ_SQL = """
+CREATE INDEX IF NOT EXISTS clients_change_seq ON clients (change_seq);
+CREATE TRIGGER IF NOT EXISTS clients_seq_insert AFTER INSERT ON clients BEGIN
+    UPDATE clients SET change_seq = (SELECT MAX(change_seq) FROM clients) + 1 WHERE rowid = NEW.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS clients_seq_update AFTER UPDATE OF updated_at ON clients BEGIN
+    UPDATE clients SET change_seq = (SELECT MAX(change_seq) FROM clients) + 1 WHERE rowid = NEW.rowid;
+END;
+"""
+
+_schema_lock = threading.Lock()
+_schema_ready: set = set()
+
+# сортировки, доступные в list_clients
+ORDER_BY = {
+    "name": "name_key, client_id",
+    "created_at": "created_at DESC, client_id",
+}
+
+
+# =========================
+#  Пути
+# =========================
+def slugify(s: str) -> str:
+    # безопасная для пути часть client_id
+    s = (s or "").strip().lower()
+    s = re.sub(r"\s+", "-", s)
+    s = re.sub(r"[^a-z0-9а-яё\-]", "", s, flags=re.IGNORECASE)
+    s = s.strip("-")
+    return s or "client"
+
+
+# ровно то, что может вернуть slugify: без "/", "." и ".."
+CLIENT_ID_RE = re.compile(r"[0-9a-zа-яё\-]+")
+
+
+def is_valid_client_id(client_id: Any) -> bool:
+    """
+    Проверка client_id, пришедшего снаружи (адрес, форма), перед
+    тем как превращать его в путь.
+    """
+    return isinstance(client_id, str) and CLIENT_ID_RE.fullmatch(client_id) is not None
+
+
+_SHARD_RE = re.compile(r"[0-9a-f]{2}")
+_legacy_layout: Optional[bool] = None
+
+
+def shard_of(client_id: str) -> str:
+    # 256 подпапок: первые два hex-символа sha1(client_id)
+    return hashlib.sha1(client_id.encode("utf-8")).hexdigest()[:2]
+
+
+def _legacy_layout_possible() -> bool:
+    # после миграции (есть маркер) плоские папки больше не ищем
+    global _legacy_layout
+    if _legacy_layout is None or _legacy_layout:
+        _legacy_layout = not os.path.exists(LAYOUT_MARKER)
+    return _legacy_layout
+
+
+def ensure_clients_dir():
+    """
+    Создаёт data/clients; новая пустая папка сразу помечается шардированной.
+    """
+    if not os.path.exists(CLIENTS_DIR):
+        os.makedirs(CLIENTS_DIR, exist_ok=True)
+        with open(LAYOUT_MARKER, "w", encoding="utf-8"):
+            pass
+
+
+def client_dir(client_id: str) -> str:
+    """
+    Папка клиента: data/clients/<shard>/<client_id>/ (shard — shard_of).
+    До миграции старые клиенты лежат в data/clients/<client_id>/ —
+    их находим по второму stat, без обхода каталога.
+    Все страницы должны получать путь только через эту функцию.
+    """
+    if not client_id or client_id in (".", "..") or "/" in client_id or "\\" in client_id or os.sep in client_id:
+        raise ValueError(f"недопустимый client_id: {client_id!r}")
+    sharded = os.path.join(CLIENTS_DIR, shard_of(client_id), client_id)
+    if _legacy_layout_possible() and not os.path.isdir(sharded):
+        legacy = os.path.join(CLIENTS_DIR, client_id)
+        if os.path.isdir(legacy):
+            return legacy
+    return sharded
+
+
+def iter_client_dirs() -> Iterator[Tuple[str, str]]:
+    """
+    Потоково обходит папки клиентов: (client_id, путь) — и в шардах,
+    и старые плоские. Не собирает и не сортирует весь список.
+    """
+    if not os.path.exists(CLIENTS_DIR):
+        return
+    with os.scandir(CLIENTS_DIR) as top:
+        for entry in top:
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            if not _SHARD_RE.fullmatch(entry.name):
+                yield entry.name, entry.path  # старая плоская раскладка
+                continue
+            with os.scandir(entry.path) as shard:
+                for e in shard:
+                    if e.is_dir() and not e.name.startswith("."):
+                        yield e.name, e.path
+
+
+def migrate_layout(dry_run: bool = False) -> Tuple[int, List[str]]:
+    """
+    Разовая миграция data/clients/<client_id> -> data/clients/<shard>/<client_id>.
+    Переносит папки через os.rename (на одном диске это атомарно).
+    Возвращает (перенесено, конфликты — client_id, у которых уже есть
+    папка в шарде). Без конфликтов ставит маркер LAYOUT_MARKER.
+    Запускать при остановленном приложении.
+    """
+    if not os.path.exists(CLIENTS_DIR):
+        if not dry_run:
+            ensure_clients_dir()
+        return 0, []
+
+    # список снимаем заранее: переименовывать во время scandir нельзя
+    legacy = [
+        name
+        for name in os.listdir(CLIENTS_DIR)
+        if not name.startswith(".")
+        and not _SHARD_RE.fullmatch(name)
+        and os.path.isdir(os.path.join(CLIENTS_DIR, name))
+    ]
+
+    moved = 0
+    conflicts: List[str] = []
+    for name in legacy:
+        target_dir = os.path.join(CLIENTS_DIR, shard_of(name))
+        target = os.path.join(target_dir, name)
+        if os.path.exists(target):
+            conflicts.append(name)
+            continue
+        if not dry_run:
+            os.makedirs(target_dir, exist_ok=True)
+            os.rename(os.path.join(CLIENTS_DIR, name), target)
+        moved += 1
+
+    if not dry_run and not conflicts:
+        with open(LAYOUT_MARKER, "w", encoding="utf-8"):
+            pass
+    return moved, conflicts
+
+
+def safe_read_json(path: str) -> Optional[Any]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+@timed("storage.save_json")
+def save_json(path: str, data, compact: bool = False):
+    """
+    Атомарная запись JSON: временный файл в той же папке + fsync + rename.
+    При падении посередине на диске остаётся старая версия, а не обрезок.
+    compact=True — без отступов, для файлов, которые читает только код (report.json).
+    """
+    dirname = os.path.dirname(path) or "."
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=dirname)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if compact:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            else:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp создаёт файл с 0600 — оставляем права как у обычной записи
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+# =========================
+#  Журнал ответов (append-only)
+# =========================
+JOURNAL_NAME = "answers.jsonl"
+
+
+def journal_path(client_id: str) -> str:
+    return os.path.join(client_dir(client_id), JOURNAL_NAME)
+
+
+@timed("storage.append_answer")
+def append_answer(client_id: str, qid: str, answer: Any, step: int):
+    """
+    Дописывает в журнал одну строку {"qid", "answer", "step", "ts"}.
+    Пишем одним write в O_APPEND — это маленькая запись, а не
+    перезапись всего файла. fsync не делаем: от падения процесса
+    защищает и так, а ждать диск на каждый клик дорого.
+    """
+    line = json.dumps(
+        {"qid": qid, "answer": answer, "step": int(step), "ts": round(time.time(), 3)},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    path = journal_path(client_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, (line + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def read_journal(client_id: str) -> Tuple[Dict[str, Any], int]:
+    """
+    Восстанавливает ответы из журнала (последняя запись по вопросу
+    побеждает) и шаг, на котором респондент остановился.
+    Недописанную последнюю строку (падение посреди записи) пропускаем.
+    """
+    answers: Dict[str, Any] = {}
+    step = 0
+    path = journal_path(client_id)
+    if not os.path.exists(path):
+        return answers, step
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(rec, dict) or not rec.get("qid"):
+                continue
+            answers[str(rec["qid"])] = rec.get("answer")
+            try:
+                step = int(rec.get("step", step))
+            except Exception:
+                pass
+    return answers, step
+
+
+def write_responses(client_id: str, respondent: Dict[str, Any], answers: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Пишет responses.json привычной формы (атомарно) и возвращает payload.
+    """
+    payload = {
+        "respondent": respondent,
+        "respondent_id": client_id,
+        "answers": answers,
+    }
+    save_json(os.path.join(client_dir(client_id), "responses.json"), payload)
+    return payload
+
+
+def compact_journal(client_id: str, respondent: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Сворачивает журнал в responses.json привычной формы, пишет его
+    атомарно и удаляет журнал. Возвращает payload responses.json.
+    """
+    answers, _ = read_journal(client_id)
+    payload = write_responses(client_id, respondent, answers)
+
+    try:
+        os.unlink(journal_path(client_id))
+    except FileNotFoundError:
+        pass
+    return payload
+
+
+# =========================
+#  Отчёты и их актуальность
+# =========================
+def answers_hash(answers_json: Dict[str, Any]) -> str:
+    """
+    sha256 канонического JSON ответов (без данных респондента),
+    чтобы понять, по тем ли ответам посчитан report.json.
+    """
+    canon = json.dumps(
+        _safe_get_answers_map(answers_json),
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+def stamp_report(report: Dict[str, Any], questionnaire: "Questionnaire", answers_json: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Дописывает в report["meta"] версию/хэш опросника и хэш ответов.
+    """
+    meta = report.setdefault("meta", {})
+    meta["questionnaire_version"] = questionnaire.version
+    meta["questionnaire_hash"] = questionnaire.content_hash
+    meta["answers_hash"] = answers_hash(answers_json)
+    meta["scored_at"] = int(time.time())
+    return report
+
+
+def is_report_current(report: Optional[Dict[str, Any]], questionnaire: "Questionnaire", answers_json: Dict[str, Any]) -> bool:
+    if not isinstance(report, dict):
+        return False
+    meta = report.get("meta") if isinstance(report.get("meta"), dict) else {}
+    return (
+        meta.get("questionnaire_hash") == questionnaire.content_hash
+        and meta.get("answers_hash") == answers_hash(answers_json)
+    )
+
+
+@timed("storage.ensure_report")
+def ensure_report(client_id: str, questionnaire: "Questionnaire") -> Optional[Dict[str, Any]]:
+    """
+    Кэш отчётов: отдаёт сохранённый report.json, если он посчитан по
+    текущему опроснику и тем же ответам; иначе лениво пересчитывает,
+    сохраняет и отдаёт свежий. Без responses.json возвращает что есть.
+    Ответы, которые нельзя посчитать, — ValueError с причиной.
+    """
+    cdir = client_dir(client_id)
+    report = safe_read_json(os.path.join(cdir, "report.json"))
+    responses = safe_read_json(os.path.join(cdir, "responses.json"))
+    if not isinstance(responses, dict):
+        return report
+
+    if is_report_current(report, questionnaire, responses):
+        return report
+
+    problem = answers_error(responses)
+    if problem is not None:
+        raise ValueError(f"responses.json клиента {client_id}: {problem}")
+    report = stamp_report(score_blocks(questionnaire.compiled, responses), questionnaire, responses)
+    save_json(os.path.join(cdir, "report.json"), report, compact=True)
+    set_report_status(client_id, REPORT_DONE)
+    return report
+
+
+# =========================
+#  Индекс клиентов (SQLite)
+# =========================
+def _name_key(name: str) -> str:
+    return (name or "").strip().casefold()
+
+
+def _phone_key(phone: str) -> str:
+    # для поиска по телефону храним только цифры
+    return re.sub(r"\D", "", phone or "")
+
+
+def _connect(path: str = INDEX_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+
+    if path not in _schema_ready:
+        with _schema_lock:
+            if path not in _schema_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                # индекс создан до появления повторов с задержкой
+                cols = {r[1] for r in conn.execute("PRAGMA table_info(jobs)")}
+                if "not_before" not in cols:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+                if "failed_at" not in cols:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN failed_at REAL")
+                # индекс создан до сквозных номеров: нумеруем как есть,
+                # читатели со старым watermark по updated_at всё равно перечитают всё
+                cols = {r[1] for r in conn.execute("PRAGMA table_info(clients)")}
+                if "change_seq" not in cols:
+                    conn.execute("ALTER TABLE clients ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+                    conn.execute("UPDATE clients SET change_seq = rowid")
+                    conn.commit()
+                conn.executescript(_CHANGE_SEQ_SQL)
+                _schema_ready.add(path)
+    return conn
+
+
+def _profile_row(profile: Dict[str, Any], report_status: Optional[str]) -> Optional[tuple]:
+    client_id = str(profile.get("client_id") or "").strip()
+    if not client_id:
+        return None
+
+    name = str(profile.get("name") or "")
+    phone = str(profile.get("phone") or "")
+    try:
+        created_at = int(profile.get("created_at") or 0)
+    except Exception:
+        created_at = 0
+
+    return (
+        client_id,
+        name,
+        _name_key(name),
+        phone,
+        _phone_key(phone),
+        created_at,
+        report_status or REPORT_NONE,
+        time.time(),
+        report_status,
+    )
+
+
+_UPSERT_SQL = """
+INSERT INTO clients (client_id, name, name_key, phone, phone_key, created_at, report_status, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(client_id) DO UPDATE SET
+    name = excluded.name,
+    name_key = excluded.name_key,
+    phone = excluded.phone,
+    phone_key = excluded.phone_key,
+    created_at = excluded.created_at,
+    report_status = COALESCE(?, clients.report_status),
+    updated_at = excluded.updated_at
+"""
+
+
+def upsert_client(profile: Dict[str, Any], report_status: Optional[str] = None):
+    """
+    Добавляет/обновляет клиента в индексе по данным profile.json.
+    report_status=None — не трогать текущий статус.
+    """
+    row = _profile_row(profile, report_status)
+    if row is None:
+        return
+    with closing(_connect()) as conn, conn:
+        conn.execute(_UPSERT_SQL, row)
+
+
+def upsert_clients(profiles: Iterable[Dict[str, Any]], report_status: Optional[str] = None) -> int:
+    # пакетный вариант upsert_client (одна транзакция); возвращает число строк
+    rows = [r for r in (_profile_row(p, report_status) for p in profiles) if r is not None]
+    if rows:
+        with closing(_connect()) as conn, conn:
+            conn.executemany(_UPSERT_SQL, rows)
+    return len(rows)
+
+
+def set_report_status(client_id: str, status: str):
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "UPDATE clients SET report_status = ?, updated_at = ? WHERE client_id = ?",
+            (status, time.time(), client_id),
+        )
+
+
+def set_report_statuses(client_ids: Iterable[str], status: str):
+    # пакетный вариант set_report_status (одна транзакция)
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.executemany(
+            "UPDATE clients SET report_status = ?, updated_at = ? WHERE client_id = ?",
+            [(status, now, cid) for cid in client_ids],
+        )
+
+
+def get_client(client_id: str) -> Optional[Dict[str, Any]]:
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT * FROM clients WHERE client_id = ?", (client_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _prefix_upper(prefix: str) -> str:
+    # верхняя граница диапазона для поиска по префиксу: "ива" -> "ивб"
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _search_where(query: str):
+    """
+    WHERE для поиска по префиксу имени, телефона или client_id.
+    Диапазоны (>= / <) вместо LIKE, чтобы SQLite шёл по индексам.
+    """
+    q = _name_key(query)
+    if not q:
+        return "", []
+
+    terms = ["(name_key >= ? AND name_key < ?)", "(client_id >= ? AND client_id < ?)"]
+    params: List[Any] = [q, _prefix_upper(q), q, _prefix_upper(q)]
+
+    digits = _phone_key(query)
+    if digits:
+        terms.append("(phone_key >= ? AND phone_key < ?)")
+        params += [digits, _prefix_upper(digits)]
+
+    return "WHERE " + " OR ".join(terms), params
+
+
+@timed("storage.list_clients")
+def list_clients(
+    order_by: str = "name",
+    limit: Optional[int] = None,
+    offset: int = 0,
+    search: str = "",
+) -> List[Dict[str, Any]]:
+    """
+    Список клиентов из индекса (без чтения profile.json).
+    search — префикс имени, телефона или client_id.
+    """
+    order = ORDER_BY.get(order_by, ORDER_BY["name"])
+    where, params = _search_where(search)
+    sql = f"SELECT client_id, name, phone, created_at, report_status FROM clients {where} ORDER BY {order}"
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [int(limit), int(offset)]
+
+    with closing(_connect()) as conn:
+        return [dict(r) for r in conn.execute(sql, params)]
+
+
+def count_clients(search: str = "") -> int:
+    where, params = _search_where(search)
+    with closing(_connect()) as conn:
+        return int(conn.execute(f"SELECT COUNT(*) FROM clients {where}", params).fetchone()[0])
+
+
+def changed_since(watermark: int, status: str = REPORT_DONE) -> List[Tuple[str, int]]:
+    """
+    Клиенты со статусом status, изменённые в индексе после watermark:
+    [(client_id, change_seq), ...] по возрастанию change_seq.
+    Новый watermark — наибольший change_seq из ответа.
+    Для инкрементальных пересчётов (аналитика, что-если).
+    """
+    with closing(_connect()) as conn:
+        return [
+            (r["client_id"], int(r["change_seq"]))
+            for r in conn.execute(
+                "SELECT client_id, change_seq FROM clients WHERE report_status = ? AND change_seq > ? ORDER BY change_seq",
+                (status, int(watermark)),
+            )
+        ]
+
+
+def clients_created_after(
+    created_at: int,
+    client_id: str = "",
+    status: str = REPORT_DONE,
+    limit: int = 10000,
+) -> List[Dict[str, Any]]:
+    """
+    Клиенты со статусом status строго после (created_at, client_id),
+    по возрастанию — для выгрузки по водяному знаку.
+    """
+    with closing(_connect()) as conn:
+        return [
+            dict(r)
+            for r in conn.execute(
+                """
+                SELECT client_id, name, phone, created_at, report_status FROM clients
+                WHERE report_status = ? AND (created_at > ? OR (created_at = ? AND client_id > ?))
+                ORDER BY created_at, client_id
+                LIMIT ?
+                """,
+                (status, int(created_at), int(created_at), client_id, int(limit)),
+            )
+        ]
+
+
+def oldest_unfinished(since: int) -> Optional[int]:
+    """
+    created_at самого раннего клиента без готового отчёта, начавшего
+    тест не раньше since (брошенные давно сессии не учитываются).
+    """
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT MIN(created_at) FROM clients WHERE report_status != ? AND created_at >= ?",
+            (REPORT_DONE, int(since)),
+        ).fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def rebuild_index() -> int:
+    """
+    Полная переиндексация по папкам data/clients (разовая миграция
+    старых клиентов или восстановление, если индекс потерян).
+    Возвращает число проиндексированных клиентов.
+    """
+    rows = []
+    for name, path in iter_client_dirs():
+        profile = safe_read_json(os.path.join(path, "profile.json")) or {}
+        # папка — источник истины для client_id
+        profile["client_id"] = name
+        has_report = os.path.exists(os.path.join(path, "report.json"))
+        row = _profile_row(profile, REPORT_DONE if has_report else REPORT_NONE)
+        if row is not None:
+            rows.append(row)
+
+    with closing(_connect()) as conn, conn:
+        conn.executemany(_UPSERT_SQL, rows)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (BACKFILL_KEY, str(time.time())))
+    return len(rows)
+
+
+def ensure_index() -> int:
+    """
+    Один раз переносит в индекс клиентов с диска и возвращает их число.
+    Пустота таблицы тут не признак: визард добавляет клиента на старте
+    теста, и он мог сделать это раньше, чем кто-то открыл Master Panel.
+    """
+    with closing(_connect()) as conn:
+        done = conn.execute("SELECT 1 FROM meta WHERE key = ?", (BACKFILL_KEY,)).fetchone()
+    if done is None:
+        rebuild_index()
+    return count_clients()
+
+
+# =========================
+#  Очередь пересчёта отчётов
+# =========================
+def enqueue_report(client_id: str):
+    """
+    Ставит клиента в очередь на расчёт отчёта и помечает его
+    REPORT_PENDING — одной транзакцией.
+    """
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (client_id, enqueued_at, claimed_at, attempts, last_error, not_before, failed_at)"
+            " VALUES (?, ?, NULL, 0, NULL, 0, NULL)",
+            (client_id, now),
+        )
+        conn.execute(
+            "UPDATE clients SET report_status = ?, updated_at = ? WHERE client_id = ?",
+            (REPORT_PENDING, now, client_id),
+        )
+
+
+def claim_jobs(limit: int, stale_after: float, max_attempts: int) -> List[str]:
+    """
+    Забирает до limit задач (свободных, у которых подошло время повтора,
+    или зависших дольше stale_after секунд) и помечает их взятыми.
+    Несколько воркеров не получат одну задачу. Зависшие задачи без
+    оставшихся попыток (воркер умирал на них) помечаются failed.
+    """
+    now = time.time()
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dead = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT client_id FROM jobs WHERE failed_at IS NULL AND attempts >= ? AND claimed_at < ?",
+                    (max_attempts, now - stale_after),
+                )
+            ]
+            if dead:
+                _fail_jobs(conn, dead, "воркер не завершил расчёт", now)
+            ids = [
+                r[0]
+                for r in conn.execute(
+                    """
+                    SELECT client_id FROM jobs
+                    WHERE failed_at IS NULL AND attempts < ? AND not_before <= ?
+                      AND (claimed_at IS NULL OR claimed_at < ?)
+                    ORDER BY enqueued_at LIMIT ?
+                    """,
+                    (max_attempts, now, now - stale_after, int(limit)),
+                )
+            ]
+            conn.executemany(
+                "UPDATE jobs SET claimed_at = ?, attempts = attempts + 1 WHERE client_id = ?",
+                [(now, cid) for cid in ids],
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return ids
+
+
+def _fail_jobs(conn: sqlite3.Connection, client_ids: List[str], error: Optional[str], now: float):
+    conn.executemany(
+        "UPDATE jobs SET claimed_at = NULL, failed_at = ?, last_error = COALESCE(?, last_error) WHERE client_id = ?",
+        [(now, error, cid) for cid in client_ids],
+    )
+    conn.executemany(
+        "UPDATE clients SET report_status = ?, updated_at = ? WHERE client_id = ?",
+        [(REPORT_FAILED, now, cid) for cid in client_ids],
+    )
+
+
+def finish_job(client_id: str, error: Optional[str] = None, max_attempts: int = 1, retry_delay: float = 0.0):
+    """
+    Успех — задача удаляется и клиент получает REPORT_DONE (если задачу
+    не поставили заново, пока считали): отчёт мог оказаться актуальным
+    без пересчёта, и тогда ensure_report статус не трогал.
+    Ошибка — задача освобождается для повтора не раньше чем через
+    retry_delay · 2^(попытка-1) секунд; после max_attempts попыток
+    клиент получает статус REPORT_FAILED, а задача остаётся с текстом
+    ошибки (её видно в Master Panel, заново ставит enqueue_report).
+    """
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        if error is None:
+            cur = conn.execute("DELETE FROM jobs WHERE client_id = ? AND claimed_at IS NOT NULL", (client_id,))
+            if cur.rowcount:
+                conn.execute(
+                    "UPDATE clients SET report_status = ?, updated_at = ? WHERE client_id = ? AND report_status != ?",
+                    (REPORT_DONE, now, client_id, REPORT_DONE),
+                )
+            return
+        row = conn.execute("SELECT attempts FROM jobs WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            return
+        attempts = int(row["attempts"])
+        if attempts >= max_attempts:
+            _fail_jobs(conn, [client_id], error, now)
+        else:
+            conn.execute(
+                "UPDATE jobs SET claimed_at = NULL, last_error = ?, not_before = ? WHERE client_id = ?",
+                (error, now + retry_delay * 2 ** max(0, attempts - 1), client_id),
+            )
+
+
+def count_jobs() -> int:
+    # только живые задачи; окончательно упавшие — это статус клиента failed
+    with closing(_connect()) as conn:
+        return int(conn.execute("SELECT COUNT(*) FROM jobs WHERE failed_at IS NULL").fetchone()[0])
+
+
+def job_error(client_id: str) -> Optional[str]:
+    # текст последней ошибки расчёта (для Master Panel)
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT last_error FROM jobs WHERE client_id = ?", (client_id,)).fetchone()
+    return row["last_error"] if row is not None else None
@@ -0,0 +1,244 @@
+# neo_whatif.py
+"""
+Симулятор «что если» для весов вопросов.
+
+Ответы всех клиентов с готовым отчётом один раз кодируются в память
+(SparseCounts: по элементу на выбор), дальше каждое изменение
+weight / invert_score / invert_multiplier — это один score_sparse
+и matrix_rows по всему архиву, без чтения и записи файлов.
+
+Кэш живёт в процессе и дочитывает только клиентов, изменившихся
+в индексе после watermark (как neo_analytics). Новая версия
+neo_blocks.json — перекодирование с нуля.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import neo_storage
+from neo_metrics import timed
+from neo_questionnaire import Questionnaire
+from neo_scoring import (
+    COLUMNS,
+    POTENTIAL_IDS,
+    ROWS,
+    CompiledQuestionnaire,
+    SparseCounts,
+    answers_error,
+    encode_answers,
+    matrix_rows,
+    score_sparse,
+)
+
+
+CHUNK_SIZE = 4096
+
+
+@dataclass
+class Archive:
+    """
+    Закодированный архив: client_ids (N,), ответы, baseline (N, 3, 3) —
+    матрица при текущих весах опросника.
+    """
+
+    compiled: CompiledQuestionnaire
+    client_ids: List[str]
+    answers: SparseCounts
+    baseline: np.ndarray
+    watermark: int = 0
+
+    def __len__(self) -> int:
+        return len(self.client_ids)
+
+
+@dataclass
+class WhatIf:
+    """
+    Итог симуляции: changed (3 columns, 3 rows) — у скольких клиентов
+    поменялся потенциал в ряду; changed_any (3,) — хоть один ряд колонки;
+    clients — у скольких поменялось хоть что-то.
+    """
+
+    total: int
+    changed: np.ndarray
+    changed_any: np.ndarray
+    clients: int
+    rows: np.ndarray
+
+
+def item_params(compiled: CompiledQuestionnaire) -> Dict[str, np.ndarray]:
+    """
+    Текущие weight / invert / invert_multiplier вопросов в порядке compiled.items.
+    """
+    return {
+        "weight": np.array([item.weight for item in compiled.items], dtype=np.float64),
+        "invert": np.array([item.invert for item in compiled.items], dtype=bool),
+        "invert_multiplier": np.array([item.invert_multiplier for item in compiled.items], dtype=np.float64),
+    }
+
+
+def deltas_of(weight: np.ndarray, invert: np.ndarray, invert_multiplier: np.ndarray) -> np.ndarray:
+    # как CompiledQuestion.delta: штрафной вопрос умножается на invert_multiplier
+    return np.where(invert, weight * invert_multiplier, weight)
+
+
+def _concat(n: int, parts: List[SparseCounts]) -> SparseCounts:
+    return SparseCounts(
+        n=n,
+        resp=np.concatenate([p.resp for p in parts]),
+        question=np.concatenate([p.question for p in parts]),
+        potential=np.concatenate([p.potential for p in parts]),
+        count=np.concatenate([p.count for p in parts]),
+    )
+
+
+def _empty(compiled: CompiledQuestionnaire) -> Archive:
+    return Archive(
+        compiled=compiled,
+        client_ids=[],
+        answers=SparseCounts(
+            n=0,
+            resp=np.zeros(0, dtype=np.int32),
+            question=np.zeros(0, dtype=np.int16),
+            potential=np.zeros(0, dtype=np.int8),
+            count=np.zeros(0, dtype=np.int16),
+        ),
+        baseline=np.zeros((0, len(COLUMNS), len(ROWS)), dtype=np.int64),
+    )
+
+
+_lock = threading.Lock()
+_loaded: Optional[Archive] = None
+
+
+@timed("whatif.load")
+def load_archive(questionnaire: Questionnaire) -> Archive:
+    """
+    Архив для текущей версии опросника; дочитывает только
+    клиентов, изменившихся после прошлого вызова.
+    """
+    global _loaded
+    compiled = questionnaire.compiled
+    with _lock:
+        archive = _loaded if _loaded is not None and _loaded.compiled is compiled else _empty(compiled)
+
+        changed = neo_storage.changed_since(archive.watermark)
+        if not changed:
+            _loaded = archive
+            return archive
+
+        pos_by_id = {cid: i for i, cid in enumerate(archive.client_ids)}
+        client_ids = list(archive.client_ids)
+        replaced: List[int] = []
+        parts: List[SparseCounts] = []
+        chunk: List[Dict[str, Any]] = []
+        chunk_pos: List[int] = []
+
+        def flush():
+            # позиции в пачке подряд не идут (обновлённые клиенты), поэтому переносим индексы
+            if not chunk:
+                return
+            sparse = SparseCounts.from_counts(encode_answers(compiled, chunk))
+            mapping = np.array(chunk_pos, dtype=np.int32)
+            parts.append(
+                SparseCounts(
+                    n=sparse.n,
+                    resp=mapping[sparse.resp],
+                    question=sparse.question,
+                    potential=sparse.potential,
+                    count=sparse.count,
+                )
+            )
+            chunk.clear()
+            chunk_pos.clear()
+
+        for cid, _ in changed:
+            responses = neo_storage.safe_read_json(os.path.join(neo_storage.client_dir(cid), "responses.json"))
+            if answers_error(responses) is not None:
+                continue  # битые ответы в симуляцию не берём
+            if cid in pos_by_id:
+                replaced.append(pos_by_id[cid])
+            else:
+                pos_by_id[cid] = len(client_ids)
+                client_ids.append(cid)
+            chunk.append(responses)
+            chunk_pos.append(pos_by_id[cid])
+            if len(chunk) >= CHUNK_SIZE:
+                flush()
+        flush()
+
+        old = archive.answers
+        if replaced:
+            # старые ответы обновлённых клиентов выкидываем целиком
+            keep = ~np.isin(old.resp, np.array(replaced, dtype=np.int32))
+            old = SparseCounts(
+                n=old.n,
+                resp=old.resp[keep],
+                question=old.question[keep],
+                potential=old.potential[keep],
+                count=old.count[keep],
+            )
+        answers = _concat(len(client_ids), [old] + parts)
+
+        pos, neg = score_sparse(compiled, answers)
+        _loaded = Archive(
+            compiled=compiled,
+            client_ids=client_ids,
+            answers=answers,
+            baseline=matrix_rows(pos, neg),
+            watermark=max(seq for _, seq in changed),
+        )
+        return _loaded
+
+
+def reset():
+    """Забыть архив — следующий load_archive закодирует всё заново."""
+    global _loaded
+    with _lock:
+        _loaded = None
+
+
+@timed("whatif.simulate")
+def simulate(
+    archive: Archive,
+    weight: np.ndarray,
+    invert: np.ndarray,
+    invert_multiplier: np.ndarray,
+) -> WhatIf:
+    """
+    Пересчитывает матрицы всего архива с другими параметрами вопросов
+    и сравнивает с baseline.
+    """
+    invert = np.asarray(invert, dtype=bool)
+    deltas = deltas_of(np.asarray(weight, dtype=np.float64), invert, np.asarray(invert_multiplier, dtype=np.float64))
+    pos, neg = score_sparse(archive.compiled, archive.answers, deltas=deltas, inverts=invert)
+    rows = matrix_rows(pos, neg)
+
+    diff = rows != archive.baseline  # (N, 3 columns, 3 rows)
+    return WhatIf(
+        total=len(archive),
+        changed=diff.sum(axis=0),
+        changed_any=diff.any(axis=2).sum(axis=0),
+        clients=int(diff.any(axis=(1, 2)).sum()),
+        rows=rows,
+    )
+
+
+def row_shift(archive: Archive, result: WhatIf, column: int, row: int) -> List[Tuple[int, int, int]]:
+    """
+    Переходы потенциала в ряду колонки: [(было, стало, клиентов), ...]
+    по убыванию числа клиентов (-1 = пусто).
+    """
+    before = archive.baseline[:, column, row]
+    after = result.rows[:, column, row]
+    moved = before != after
+    if not moved.any():
+        return []
+    pairs, counts = np.unique(np.stack([before[moved], after[moved]], axis=1), axis=0, return_counts=True)
+    order = np.argsort(-counts, kind="stable")
+    return [(int(pairs[i, 0]), int(pairs[i, 1]), int(counts[i])) for i in order]
@@ -1,7 +1,10 @@
 import os
+import sys
 import json
+import time
 from pathlib import Path
 import importlib.util
+import numpy as np
 import streamlit as st
 
 # =========================
@@ -24,36 +27,35 @@ if not hasattr(auth_mod, "require_master_password"):
 
 auth_mod.require_master_password()
 
+# общие модули проекта лежат в корне репозитория
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import neo_analytics  # noqa: E402
+import neo_items  # noqa: E402
+import neo_queue  # noqa: E402
+import neo_storage  # noqa: E402
+import neo_whatif  # noqa: E402
+from neo_questionnaire import BLOCKS_PATH, load_questionnaire, save_blocks  # noqa: E402
+
 # =========================
 #  Page config
 # =========================
 st.set_page_config(page_title="Master Panel — NEO", layout="wide")
 st.title("🛠️ Master Panel — NEO Potentials")
 
-DATA_DIR = "data"
-CLIENTS_DIR = os.path.join(DATA_DIR, "clients")  # data/clients/<client_id>/
-BLOCKS_PATH = "neo_blocks.json"
+# воркер очереди отчётов живёт в процессе, с какой бы страницы его ни открыли
+neo_queue.start_worker(BLOCKS_PATH)
 
 
 # =========================
 #  Helpers
 # =========================
 def ensure_dirs():
-    os.makedirs(CLIENTS_DIR, exist_ok=True)
-
+    neo_storage.ensure_clients_dir()
 
-def load_json(path: str):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
 
-
-def safe_read_json(path: str):
-    if not os.path.exists(path):
-        return None
-    try:
-        return load_json(path)
-    except Exception:
-        return None
+safe_read_json = neo_storage.safe_read_json
 
 
 def potentials_map(blocks_data: dict) -> dict:
@@ -119,7 +121,8 @@ def format_matrix_text(report: dict, pot_ru: dict) -> str:
         return (
             "В report.json нет поля **matrix**.\n\n"
             "Скорее всего у клиента старый report.json.\n"
-            "Решение: пройти тест заново и нажать **Завершить** (Finish), чтобы пересчитать отчёт."
+            "Решение: пересчитать отчёты командой `python neo_rescore.py` "
+            "(нужен responses.json) или пройти тест заново и нажать **Завершить** (Finish)."
         )
 
     col_ru = {
@@ -155,18 +158,23 @@ def format_matrix_text(report: dict, pot_ru: dict) -> str:
     return "\n".join(lines)
 
 
-def list_clients():
+PAGE_SIZE = 50
+
+
+def list_clients(search: str = "", order_by: str = "name", page: int = 1):
     """
-    Возвращает список client_id (папки) из data/clients
+    Одна страница клиентов из индекса (neo_storage) + общее число найденных.
+    profile.json при этом не читаются.
     """
-    if not os.path.exists(CLIENTS_DIR):
-        return []
-    ids = []
-    for name in sorted(os.listdir(CLIENTS_DIR)):
-        p = os.path.join(CLIENTS_DIR, name)
-        if os.path.isdir(p):
-            ids.append(name)
-    return ids
+    neo_storage.ensure_index()
+    total = neo_storage.count_clients(search=search)
+    offset = (max(1, page) - 1) * PAGE_SIZE
+    rows = neo_storage.list_clients(order_by=order_by, limit=PAGE_SIZE, offset=offset, search=search)
+    return rows, total
+
+
+def _reset_page():
+    st.session_state["clients_page"] = 1
 
 
 # =========================
@@ -174,33 +182,89 @@ def list_clients():
 # =========================
 ensure_dirs()
 
-blocks_data = safe_read_json(BLOCKS_PATH) or {}
+try:
+    questionnaire = load_questionnaire(BLOCKS_PATH)
+    blocks_data = questionnaire.blocks
+except Exception:
+    questionnaire = None
+    blocks_data = {}
 pot_ru = potentials_map(blocks_data)
 
 st.subheader("1) Клиенты")
 
-client_ids = list_clients()
-if not client_ids:
-    st.info("Пока нет клиентов. Клиенты появятся после прохождения диагностики на главной странице (после «Завершить»).")
+f1, f2 = st.columns([3, 1])
+with f1:
+    search = st.text_input(
+        "Поиск (начало имени, телефона или client_id):",
+        key="clients_search",
+        on_change=_reset_page,
+    )
+with f2:
+    order_label = st.selectbox(
+        "Сортировка:",
+        ["По имени", "Сначала новые"],
+        key="clients_order",
+        on_change=_reset_page,
+    )
+order_by = "created_at" if order_label == "Сначала новые" else "name"
+
+if "clients_page" not in st.session_state:
+    st.session_state["clients_page"] = 1
+
+clients, total = list_clients(search=search, order_by=order_by, page=st.session_state["clients_page"])
+if not total:
+    if search.strip():
+        st.info("Никого не нашли по этому запросу.")
+    else:
+        st.info("Пока нет клиентов. Клиенты появятся после прохождения диагностики на главной странице (после «Завершить»).")
     st.stop()
 
-# читаем профили
-clients = []
-for cid in client_ids:
-    profile = safe_read_json(os.path.join(CLIENTS_DIR, cid, "profile.json")) or {}
-    label = profile.get("name") or cid
-    clients.append((label, cid))
-
-clients.sort(key=lambda x: x[0].lower())
-
-selected_label = st.selectbox("Выбери клиента:", [c[0] for c in clients], index=0)
-selected_cid = dict(clients)[selected_label]
+pages_total = (total + PAGE_SIZE - 1) // PAGE_SIZE
+if st.session_state["clients_page"] > pages_total:
+    st.session_state["clients_page"] = pages_total
+    st.rerun()
+
+p1, p2, p3 = st.columns([1, 2, 1])
+with p1:
+    if st.button("← Пред.", use_container_width=True, disabled=st.session_state["clients_page"] <= 1):
+        st.session_state["clients_page"] -= 1
+        st.rerun()
+with p2:
+    st.caption(f"Страница {st.session_state['clients_page']} из {pages_total} • найдено клиентов: {total}")
+with p3:
+    if st.button("След. →", use_container_width=True, disabled=st.session_state["clients_page"] >= pages_total):
+        st.session_state["clients_page"] += 1
+        st.rerun()
+
+labels = {
+    c["client_id"]: f"{c['name'] or c['client_id']} · {c['phone'] or '—'}"
+    + (" · ⏳ считается" if c["report_status"] == neo_storage.REPORT_PENDING else "")
+    + (" · ⚠️ ошибка расчёта" if c["report_status"] == neo_storage.REPORT_FAILED else "")
+    for c in clients
+}
+status_by_cid = {c["client_id"]: c["report_status"] for c in clients}
+
+selected_cid = st.selectbox(
+    "Выбери клиента:",
+    [c["client_id"] for c in clients],
+    index=0,
+    format_func=lambda cid: labels.get(cid, cid),
+)
+
+if st.button("🔄 Переиндексировать клиентов"):
+    neo_storage.rebuild_index()
+    st.rerun()
+
+queued = neo_storage.count_jobs()
+if queued:
+    st.caption(f"⏳ В очереди на расчёт отчёта: {queued}")
 
 colA, colB = st.columns([1, 2])
 
 with colA:
     st.subheader("Профиль")
-    profile_path = os.path.join(CLIENTS_DIR, selected_cid, "profile.json")
+    cdir = neo_storage.client_dir(selected_cid)
+    profile_path = os.path.join(cdir, "profile.json")
     prof = safe_read_json(profile_path) or {}
     st.write(f"**Имя:** {prof.get('name', '—')}")
     st.write(f"**Телефон:** {prof.get('phone', '—')}")
@@ -208,19 +272,55 @@ with colA:
 
     st.divider()
     st.caption("Файлы клиента:")
-    st.code("\n".join(sorted(os.listdir(os.path.join(CLIENTS_DIR, selected_cid)))))
+    # временные файлы атомарной записи (.tmp-*) не показываем
+    files = sorted(n for n in os.listdir(cdir) if not n.startswith(".")) if os.path.isdir(cdir) else []
+    st.code("\n".join(files) or "—")
 
 with colB:
     st.subheader("Результат")
-    report_path = os.path.join(CLIENTS_DIR, selected_cid, "report.json")
-    report = safe_read_json(report_path)
-
-    if not report:
-        st.warning("report.json пока нет. Клиент должен пройти тест до конца и нажать «Завершить».")
+    pending = status_by_cid.get(selected_cid) == neo_storage.REPORT_PENDING
+    if pending:
+        # отчёт считает воркер очереди; синхронно — только по кнопке
+        st.info("⏳ Ответы сохранены, отчёт ещё считается в фоне. Обнови страницу чуть позже.")
+        if questionnaire is not None and st.button("Посчитать сейчас", use_container_width=True):
+            try:
+                neo_storage.ensure_report(selected_cid, questionnaire)
+                # отчёт мог быть уже актуален — тогда ensure_report статус не меняет
+                neo_storage.set_report_status(selected_cid, neo_storage.REPORT_DONE)
+                st.rerun()
+            except ValueError as e:
+                st.error("Ответы клиента не считаются")
+                st.code(str(e))
+        report = None
+    elif status_by_cid.get(selected_cid) == neo_storage.REPORT_FAILED:
+        # очередь сдалась после нескольких попыток — показываем причину
+        st.error("⚠️ Отчёт не посчитался после нескольких попыток.")
+        st.code(neo_storage.job_error(selected_cid) or "причина не сохранена")
+        if st.button("Поставить в очередь снова", use_container_width=True):
+            neo_storage.enqueue_report(selected_cid)
+            neo_queue.kick()
+            st.rerun()
+        report = None
+    elif questionnaire is not None:
+        # устаревший (другая версия опросника / другие ответы) отчёт пересчитается здесь
+        try:
+            report = neo_storage.ensure_report(selected_cid, questionnaire)
+        except ValueError as e:
+            # битый responses.json — показываем причину, а не падаем всей страницей
+            st.error("Ответы клиента не считаются")
+            st.code(str(e))
+            report = None
     else:
+        report = safe_read_json(os.path.join(neo_storage.client_dir(selected_cid), "report.json"))
+
+    if report:
         text = format_matrix_text(report, pot_ru)
         st.markdown(text)
 
+        meta = report.get("meta") if isinstance(report.get("meta"), dict) else {}
+        if meta.get("questionnaire_version"):
+            st.caption(f"Посчитано по опроснику версии {meta['questionnaire_version']}.")
+
         st.download_button(
             "⬇️ Скачать результат (txt)",
             data=text.encode("utf-8"),
@@ -229,6 +329,168 @@ with colB:
             use_container_width=True,
         )
 
+        # похожие клиенты — поиск по колоночному кэшу аналитики, JSON не читаем
+        if st.toggle("👥 Похожие клиенты", value=False, key="show_similar"):
+            s1, s2 = st.columns(2)
+            with s1:
+                k = st.number_input("Сколько показать:", min_value=1, max_value=50, value=5, step=1)
+            with s2:
+                metric_label = st.selectbox("Похожесть:", ["По форме профиля", "По баллам"], key="similar_metric")
+            metric = "euclidean" if metric_label == "По баллам" else "cosine"
+
+            table = neo_analytics.refresh()
+            neighbours = neo_analytics.similar(table, selected_cid, k=int(k), metric=metric)
+            if not neighbours:
+                st.caption("Пока не с кем сравнить.")
+            else:
+                sim_rows = []
+                for cid, score in neighbours:
+                    row = neo_storage.get_client(cid) or {}
+                    cells = table.rows[table.index_of(cid)]
+                    sim_rows.append(
+                        {
+                            "Клиент": row.get("name") or cid,
+                            "Телефон": row.get("phone") or "—",
+                            "Сходство" if metric == "cosine" else "Расстояние": round(score, 3),
+                            **{
+                                f"Ряд 1 · {c}": pot_ru.get(neo_analytics.POTENTIAL_IDS[cells[ci, 0]], "—") if cells[ci, 0] >= 0 else "—"
+                                for ci, c in enumerate(("Восприятие", "Мотивация", "Инструмент"))
+                            },
+                            "client_id": cid,
+                        }
+                    )
+                st.dataframe(sim_rows, hide_index=True, use_container_width=True)
+    elif not pending:
+        st.warning("report.json пока нет. Клиент должен пройти тест до конца и нажать «Завершить».")
+
+st.divider()
+
+# =========================
+#  Аналитика по всем клиентам
+# =========================
+st.subheader("2) Аналитика по всем клиентам")
+
+if st.toggle("Показать аналитику", value=False, key="show_analytics"):
+    # дочитываем в колоночный кэш только новые/пересчитанные отчёты
+    table = neo_analytics.refresh()
+    st.caption(f"Клиентов с отчётом: {len(table)}")
+
+    if len(table):
+        col_ru = {"perception": "Восприятие", "motivation": "Мотивация", "instrument": "Инструмент"}
+        names = [pot_ru.get(pid, pid) for pid in neo_analytics.POTENTIAL_IDS]
+
+        st.markdown("**Распределение рядов по колонкам** (сколько клиентов)")
+        dist = neo_analytics.row_distribution(table)
+        tabs = st.tabs([col_ru.get(c, c) for c in neo_analytics.COLUMNS])
+        for ci, tab in enumerate(tabs):
+            with tab:
+                st.dataframe(
+                    {
+                        "Потенциал": names,
+                        "Ряд 1": dist[ci, 0].tolist(),
+                        "Ряд 2": dist[ci, 1].tolist(),
+                        "Ряд 3": dist[ci, 2].tolist(),
+                    },
+                    hide_index=True,
+                    use_container_width=True,
+                )
+
+        st.markdown("**Гистограммы силы потенциалов** (strength = сумма по колонкам)")
+        hist = neo_analytics.strength_histograms(table)
+        edges = hist["edges"]
+        bin_labels = [f"{edges[i]:.1f}…{edges[i + 1]:.1f}" for i in range(len(edges) - 1)]
+        hist_rows = {"Потенциал": names}
+        for bi, label in enumerate(bin_labels):
+            hist_rows[label] = hist["counts"][:, bi].tolist()
+        st.dataframe(hist_rows, hide_index=True, use_container_width=True)
+
+        st.markdown("**Совместная встречаемость** (оба потенциала в рядах 1–2 у одного клиента)")
+        co = neo_analytics.cooccurrence(table)
+        co_rows = {"Потенциал": names}
+        for pi, name in enumerate(names):
+            co_rows[name] = co[:, pi].tolist()
+        st.dataframe(co_rows, hide_index=True, use_container_width=True)
+
+    if st.button("♻️ Перестроить кэш аналитики"):
+        neo_analytics.rebuild()
+        st.rerun()
+
+st.divider()
+
+# =========================
+#  Что если: веса вопросов
+# =========================
+st.subheader("3) Что если: веса вопросов")
+
+if questionnaire is None:
+    st.caption("Нет валидного neo_blocks.json.")
+elif st.toggle("Открыть симулятор", value=False, key="show_whatif"):
+    st.caption("Правки здесь ничего не сохраняют — только показывают, у скольких клиентов поменялась бы матрица.")
+    with st.spinner("Кодируем архив ответов…"):
+        archive = neo_whatif.load_archive(questionnaire)
+
+    compiled = questionnaire.compiled
+    current = neo_whatif.item_params(compiled)
+    edited = st.data_editor(
+        {
+            "id": [item.qid for item in compiled.items],
+            "Колонка": [item.column for item in compiled.items],
+            "weight": current["weight"].tolist(),
+            "invert_score": current["invert"].tolist(),
+            "invert_multiplier": current["invert_multiplier"].tolist(),
+        },
+        disabled=["id", "Колонка"],
+        hide_index=True,
+        use_container_width=True,
+        key="whatif_editor",
+    )
+
+    t0 = time.perf_counter()
+    result = neo_whatif.simulate(
+        archive,
+        np.nan_to_num(np.array(edited["weight"], dtype=np.float64)),
+        np.array(edited["invert_score"], dtype=bool),
+        np.nan_to_num(np.array(edited["invert_multiplier"], dtype=np.float64), nan=1.0),
+    )
+    elapsed = time.perf_counter() - t0
+
+    st.caption(f"Клиентов в архиве: {result.total} • пересчёт за {elapsed * 1e3:.0f} мс")
+    if result.total:
+        col_ru = {"perception": "Восприятие", "motivation": "Мотивация", "instrument": "Инструмент"}
+        st.metric("Клиентов с другой матрицей", f"{result.clients} ({result.clients / result.total:.1%})")
+        st.dataframe(
+            {
+                "Колонка": [col_ru.get(c, c) for c in neo_whatif.COLUMNS],
+                "Ряд 1": result.changed[:, 0].tolist(),
+                "Ряд 2": result.changed[:, 1].tolist(),
+                "Ряд 3": result.changed[:, 2].tolist(),
+                "Любой ряд": result.changed_any.tolist(),
+            },
+            hide_index=True,
+            use_container_width=True,
+        )
+
+        if result.clients:
+            ci = st.selectbox(
+                "Переходы в колонке",
+                list(range(len(neo_whatif.COLUMNS))),
+                format_func=lambda i: col_ru.get(neo_whatif.COLUMNS[i], neo_whatif.COLUMNS[i]),
+                key="whatif_column",
+            )
+            ids = neo_whatif.POTENTIAL_IDS
+            shift = {"Ряд": [], "Было": [], "Стало": [], "Клиентов": []}
+            for ri in range(len(neo_whatif.ROWS)):
+                for before, after, n in neo_whatif.row_shift(archive, result, ci, ri)[:10]:
+                    shift["Ряд"].append(ri + 1)
+                    shift["Было"].append(pot_ru.get(ids[before], ids[before]) if before >= 0 else "—")
+                    shift["Стало"].append(pot_ru.get(ids[after], ids[after]) if after >= 0 else "—")
+                    shift["Клиентов"].append(n)
+            st.dataframe(shift, hide_index=True, use_container_width=True)
+
+    if st.button("♻️ Перечитать архив ответов"):
+        neo_whatif.reset()
+        st.rerun()
+
 st.divider()
 
 # Опционально: редактор blocks — спрятан
@@ -236,8 +498,12 @@ with st.expander("⚙️ (Опционально) Редактор neo_blocks.js
     if not os.path.exists(BLOCKS_PATH):
         st.error(f"Не найден {BLOCKS_PATH}")
     else:
-        raw = load_json(BLOCKS_PATH)
-        text_default = json.dumps(raw, ensure_ascii=False, indent=2)
+        try:
+            text_default = json.dumps(load_questionnaire(BLOCKS_PATH).blocks, ensure_ascii=False, indent=2)
+        except Exception:
+            # битый файл показываем как есть, чтобы его можно было поправить
+            with open(BLOCKS_PATH, "r", encoding="utf-8") as f:
+                text_default = f.read()
         text = st.text_area("neo_blocks.json", value=text_default, height=420)
 
         c1, c2 = st.columns(2)
@@ -254,9 +520,49 @@ with st.expander("⚙️ (Опционально) Редактор neo_blocks.js
             if st.button("💾 Save neo_blocks.json"):
                 try:
                     parsed = json.loads(text)
-                    with open(BLOCKS_PATH, "w", encoding="utf-8") as f:
-                        json.dump(parsed, f, ensure_ascii=False, indent=2)
+                    # пишет файл и сразу сбрасывает общий кэш опросника
+                    save_blocks(parsed, BLOCKS_PATH)
                     st.success("Сохранено ✅")
                 except Exception as e:
                     st.error("Не сохранилось")
-                    st.code(str(e))
\ No newline at end of file
+                    st.code(str(e))
+
+        # статистика по вопросам — рядом с редактором, чтобы править веса по данным
+        st.markdown("#### 📊 Статистика вопросов (по всем responses.json)")
+        if st.button("🔁 Пересчитать статистику вопросов"):
+            with st.spinner("Считаем по архиву ответов…"):
+                neo_items.run()
+
+        items_stats = neo_items.load_result()
+        if not items_stats:
+            st.caption("Статистика ещё не считалась (или: `python neo_items.py`).")
+        else:
+            if questionnaire is not None and items_stats.get("questionnaire_hash") != questionnaire.content_hash:
+                st.warning("Статистика посчитана по другой версии neo_blocks.json — пересчитайте.")
+            st.caption(f"Респондентов: {items_stats.get('respondents', 0)}")
+
+            rows = {
+                "id": [],
+                "Колонка": [],
+                "weight": [],
+                "Штрафной": [],
+                "Ответили": [],
+                "Частоты выбора": [],
+                "Дискриминация": [],
+                "Межпунктовая r": [],
+            }
+            for qid, it in (items_stats.get("items") or {}).items():
+                freq = it.get("freq") or {}
+                rows["id"].append(qid)
+                rows["Колонка"].append(it.get("column"))
+                rows["weight"].append(it.get("weight"))
+                rows["Штрафной"].append(bool(it.get("invert")))
+                rows["Ответили"].append(it.get("answered"))
+                rows["Частоты выбора"].append(", ".join(f"{pot_ru.get(p, p)} {v:.0%}" for p, v in freq.items()))
+                rows["Дискриминация"].append(it.get("discrimination"))
+                rows["Межпунктовая r"].append(it.get("inter_item"))
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+            st.caption(
+                "Дискриминация > 0 — вопрос работает как задуман: выбор поднимает потенциал в row1, "
+                "а у штрафных вопросов — уводит из row1 (знак у них перевёрнут)."
+            )
\ No newline at end of file
@@ -0,0 +1,109 @@
+import sys
+import time
+from pathlib import Path
+import importlib.util
+import streamlit as st
+
+# =========================
+#  Load auth.py safely
+# =========================
+ROOT = Path(__file__).resolve().parents[1]
+AUTH_PATH = ROOT / "auth.py"
+
+if not AUTH_PATH.exists():
+    st.error(f"Не найден auth.py в корне репозитория: {AUTH_PATH}")
+    st.stop()
+
+spec = importlib.util.spec_from_file_location("neo_auth_local", str(AUTH_PATH))
+auth_mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(auth_mod)
+
+if not hasattr(auth_mod, "require_master_password"):
+    st.error("В auth.py нет функции require_master_password().")
+    st.stop()
+
+auth_mod.require_master_password()
+
+# общие модули проекта лежат в корне репозитория
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import neo_metrics  # noqa: E402
+
+# =========================
+#  Page config
+# =========================
+st.set_page_config(page_title="Метрики — NEO", layout="wide")
+st.title("⏱️ Метрики производительности")
+
+if not neo_metrics.ENABLED:
+    st.info("Метрики выключены. Запусти приложение с переменной окружения NEO_METRICS=1, чтобы собирать замеры.")
+    st.stop()
+
+snap = neo_metrics.snapshot()
+st.caption(
+    f"Замеры с {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snap['started_at']))}; "
+    f"перцентили — по последним {neo_metrics.RECENT} вызовам каждого таймера."
+)
+
+c1, c2 = st.columns(2)
+with c1:
+    if st.button("🔄 Обновить", use_container_width=True):
+        st.rerun()
+with c2:
+    if st.button("🧹 Сбросить", use_container_width=True):
+        neo_metrics.reset()
+        st.rerun()
+
+# =========================
+#  Таймеры
+# =========================
+st.subheader("Таймеры, мс")
+timer_rows = [
+    {
+        "Шаг": name,
+        "Вызовов": t["count"],
+        "p50": round(t["p50"] * 1e3, 3),
+        "p90": round(t["p90"] * 1e3, 3),
+        "p99": round(t["p99"] * 1e3, 3),
+        "max": round(t["max"] * 1e3, 3),
+        "Всего, с": round(t["sum"], 3),
+    }
+    for name, t in snap["timers"].items()
+]
+if timer_rows:
+    st.dataframe(timer_rows, hide_index=True, use_container_width=True)
+else:
+    st.caption("Пока нет замеров — пройди пару вопросов в визарде.")
+
+st.subheader("Счётчики")
+if snap["counters"]:
+    st.dataframe(
+        [{"Счётчик": name, "Значение": value} for name, value in snap["counters"].items()],
+        hide_index=True,
+        use_container_width=True,
+    )
+else:
+    st.caption("Счётчиков пока нет.")
+
+# =========================
+#  Выгрузка
+# =========================
+st.divider()
+d1, d2 = st.columns(2)
+with d1:
+    st.download_button(
+        "⬇️ JSON",
+        data=neo_metrics.to_json(snap).encode("utf-8"),
+        file_name="neo_metrics.json",
+        mime="application/json",
+        use_container_width=True,
+    )
+with d2:
+    st.download_button(
+        "⬇️ Prometheus",
+        data=neo_metrics.to_prometheus(snap).encode("utf-8"),
+        file_name="neo_metrics.prom",
+        mime="text/plain",
+        use_container_width=True,
+    )
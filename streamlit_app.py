@@ -1,90 +1,42 @@
-import json
 import os
-import re
 import time
 import streamlit as st
 
+import neo_metrics
+import neo_queue
+
 # --- try import scoring ---
 try:
-    from neo_scoring import score_blocks
+    from neo_scoring import COLUMNS, IncrementalScorer
 except Exception as e:
-    st.error("Не могу импортировать score_blocks из neo_scoring.py. Проверь, что neo_scoring.py лежит в корне и внутри есть def score_blocks(...).")
+    st.error("Не могу импортировать IncrementalScorer из neo_scoring.py. Проверь, что neo_scoring.py лежит в корне и внутри есть class IncrementalScorer.")
     st.code(str(e))
     st.stop()
 
-BLOCKS_PATH = "neo_blocks.json"
-DATA_DIR = "data"
-CLIENTS_DIR = os.path.join(DATA_DIR, "clients")
-os.makedirs(CLIENTS_DIR, exist_ok=True)
+from neo_questionnaire import BLOCKS_PATH, load_questionnaire
+from neo_sessions import get_store, new_token, token_matches
+from neo_storage import (
+    REPORT_NONE,
+    client_dir,
+    enqueue_report,
+    ensure_clients_dir,
+    is_valid_client_id,
+    save_json,
+    slugify,
+    upsert_client,
+)
+
+ensure_clients_dir()
+# отчёты после «Завершить» считает фоновый воркер (или отдельный процесс)
+neo_queue.start_worker(BLOCKS_PATH)
 
 st.set_page_config(page_title="NEO Potentials — Диагностика", layout="centered")
 
-
-# ---------------- helpers ----------------
-def load_json(path: str):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def save_json(path: str, data):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-
-def slugify(s: str) -> str:
-    s = (s or "").strip().lower()
-    s = re.sub(r"\s+", "-", s)
-    s = re.sub(r"[^a-z0-9а-яё\-]", "", s, flags=re.IGNORECASE)
-    s = s.strip("-")
-    return s or "client"
-
-
-def get_opt_label(opt: dict) -> str:
-    return opt.get("label") or opt.get("text") or opt.get("title") or ""
-
-
-def get_opt_potential(opt: dict) -> str:
-    return (opt.get("potential") or opt.get("potential_id") or opt.get("id") or opt.get("code") or "").strip()
-
-
-def is_single(qtype: str) -> bool:
-    qtype = (qtype or "").lower()
-    return qtype in ("single_select", "single_choice", "radio")
-
-
-def is_multi(qtype: str) -> bool:
-    qtype = (qtype or "").lower()
-    return qtype in ("multi_select", "multi_choice", "checkbox")
-
-
-def normalize_blocks(blocks_data: dict):
-    blocks = blocks_data.get("blocks", [])
-    if not isinstance(blocks, list):
-        return []
-
-    flat = []
-    for b in blocks:
-        bname = b.get("block_name") or b.get("name") or ""
-        bcode = b.get("block_code") or b.get("code") or ""
-        qs = b.get("questions", [])
-        if not isinstance(qs, list):
-            continue
-        for q in qs:
-            q2 = dict(q)
-            q2["_block_name"] = bname
-            q2["_block_code"] = bcode
-            flat.append(q2)
-
-    # сортируем по order если есть
-    def keyfn(q):
-        try:
-            return int(q.get("order", 9999))
-        except Exception:
-            return 9999
-
-    flat.sort(key=keyfn)
-    return flat
+# адаптивный режим: пропускать вопросы, которые уже не могут изменить матрицу
+# NEO_ADAPTIVE=1 — по порядку, NEO_ADAPTIVE=reorder — сначала самые информативные
+ADAPTIVE = os.environ.get("NEO_ADAPTIVE", "").strip().lower()
+if ADAPTIVE in ("", "0", "false", "no", "off"):
+    ADAPTIVE = ""
 
 
 # ---------------- load blocks ----------------
@@ -92,14 +44,16 @@ if not os.path.exists(BLOCKS_PATH):
     st.error(f"Не найден файл {BLOCKS_PATH} в корне репозитория.")
     st.stop()
 
+# парсинг и нормализация — один раз на процесс, пока файл не изменился
 try:
-    blocks_data = load_json(BLOCKS_PATH)
+    questionnaire = load_questionnaire(BLOCKS_PATH)
 except Exception as e:
     st.error("neo_blocks.json битый или не читается.")
     st.code(str(e))
     st.stop()
 
-questions = normalize_blocks(blocks_data)
+blocks_data = questionnaire.blocks
+questions = questionnaire.questions
 if not questions:
     st.error("В neo_blocks.json не найдено вопросов: blocks -> questions пусто.")
     st.stop()
@@ -118,6 +72,42 @@ if "answers" not in st.session_state:
 if "step" not in st.session_state:
     st.session_state.step = 0
 
+# пройденные шаги (индексы вопросов) — для «Назад» в адаптивном режиме
+if "path" not in st.session_state:
+    st.session_state.path = []
+
+# ---------------- resume after restart ----------------
+# client_id и токен сессии лежат в адресе (?client=...&token=...), состояние —
+# в хранилище сессий (NEO_SESSION_BACKEND), поэтому продолжить можно в любом
+# процессе/реплике. client_id из адреса — это путь к папке, поэтому сначала
+# проверяем его формат, а продолжить даём только с токеном, выданным на старте
+sessions = get_store()
+
+if not st.session_state.client_created and st.query_params.get("client"):
+    _client = st.query_params.get("client")
+    _state = sessions.load(_client) if is_valid_client_id(_client) else None
+    if token_matches(_state, st.query_params.get("token")):
+        st.session_state.respondent = _state.respondent
+        st.session_state.answers = _state.answers
+        st.session_state.step = _state.step
+        # порядок переходов не хранится — «Назад» идёт по отвеченным вопросам
+        st.session_state.path = [
+            i for i, v in enumerate(questionnaire.views) if v.qid in _state.answers and i != _state.step
+        ]
+        st.session_state.client_created = True
+    else:
+        # тест уже завершён или ссылка чужая — начинаем с начала
+        del st.query_params["client"]
+        if "token" in st.query_params:
+            del st.query_params["token"]
+
+# скоринг считается по ходу ответов, а не только на «Завершить»;
+# если опросник поменяли посреди сессии — пересобираем по текущим ответам
+if "scorer" not in st.session_state or st.session_state.scorer.compiled is not questionnaire.compiled:
+    st.session_state.scorer = IncrementalScorer(questionnaire.compiled)
+    for _qid, _ans in st.session_state.answers.items():
+        st.session_state.scorer.set_answer(_qid, _ans)
+
 
 # ---------------- UI: start screen ----------------
 st.title("NEO Potentials — Диагностика")
@@ -146,51 +136,51 @@ if not st.session_state.client_created:
         }
 
         # создаём папку клиента и сохраняем profile.json сразу
-        client_dir = os.path.join(CLIENTS_DIR, client_id)
-        os.makedirs(client_dir, exist_ok=True)
-        save_json(os.path.join(client_dir, "profile.json"), st.session_state.respondent)
+        cdir = client_dir(client_id)
+        os.makedirs(cdir, exist_ok=True)
+        save_json(os.path.join(cdir, "profile.json"), st.session_state.respondent)
+        upsert_client(st.session_state.respondent, report_status=REPORT_NONE)
+        token = new_token()
+        sessions.start(st.session_state.respondent, token)
 
         st.session_state.client_created = True
         st.session_state.step = 0
+        st.session_state.path = []
         st.session_state.answers = {}
+        st.session_state.scorer = IncrementalScorer(questionnaire.compiled)
+        st.query_params["client"] = client_id
+        st.query_params["token"] = token
         st.rerun()
 
     st.stop()
 
 
 # ---------------- UI: one-question-per-page ----------------
+neo_metrics.incr("wizard.rerun")
+_t_render = time.perf_counter()
+
 idx = int(st.session_state.step)
 idx = max(0, min(idx, len(questions) - 1))
-q = questions[idx]
+# подписи/потенциалы вопроса уже разобраны при загрузке опросника
+view = questionnaire.views[idx]
 
 total = len(questions)
-progress = (idx + 1) / total
-
-st.progress(progress)
-st.caption(f"Вопрос {idx + 1} из {total} • Осталось: {total - (idx + 1)}")
+if ADAPTIVE:
+    asked = len(st.session_state.path) + 1
+    st.progress(asked / total)
+    st.caption(f"Вопрос {asked} • Осталось не больше: {total - asked}")
+else:
+    st.progress((idx + 1) / total)
+    st.caption(f"Вопрос {idx + 1} из {total} • Осталось: {total - (idx + 1)}")
 
-prompt = q.get("prompt") or ""
-st.markdown(f"<h2 style='text-align:center; margin-top: 0.2rem;'>{prompt}</h2>", unsafe_allow_html=True)
+st.markdown(f"<h2 style='text-align:center; margin-top: 0.2rem;'>{view.prompt}</h2>", unsafe_allow_html=True)
 
-qtype = (q.get("type") or "").lower()
-qid = q.get("id")
+qid = view.qid
 
 if not qid:
     st.error("У вопроса нет id. Проверь neo_blocks.json.")
     st.stop()
 
-options = q.get("options", []) or []
-option_labels = []
-option_potentials = []
-
-for opt in options:
-    pot = get_opt_potential(opt)
-    lab = get_opt_label(opt)
-    if not pot or not lab:
-        continue
-    option_potentials.append(pot)   # amber / citrine / heliodor ...
-    option_labels.append(lab)       # человекочитаемо
-
 key = f"ui_{qid}"
 
 # restore previous
@@ -198,49 +188,32 @@ prev = st.session_state.answers.get(qid, {})
 prev_selected = prev.get("selected", []) if isinstance(prev, dict) else []
 
 # --- render answer input ---
-if is_single(qtype):
+if view.kind == "single":
     # radio needs index, so we'll map selected -> label
-    default_index = None
-    if prev_selected:
-        try:
-            pot0 = prev_selected[0]
-            if pot0 in option_potentials:
-                default_index = option_potentials.index(pot0)
-        except Exception:
-            default_index = None
-
     chosen = st.radio(
         "Выберите 1 вариант:",
-        option_labels,
-        index=default_index,
+        view.labels,
+        index=view.default_index(prev_selected),
         key=key
     )
 
     if chosen is not None:
-        pos = option_labels.index(chosen)
-        pot = option_potentials[pos]
-        st.session_state.answers[qid] = {"selected": [pot]}
-
-elif is_multi(qtype):
-    max_choices = q.get("max_choices")
-    default = []
-    for pot in prev_selected:
-        if pot in option_potentials:
-            default.append(option_labels[option_potentials.index(pot)])
+        st.session_state.answers[qid] = {"selected": [view.potential_by_label[chosen]]}
 
+elif view.kind == "multi":
     chosen_list = st.multiselect(
         "Выберите варианты:",
-        option_labels,
-        default=default,
+        view.labels,
+        default=view.default_labels(prev_selected),
         key=key
     )
 
-    selected_pots = [option_potentials[option_labels.index(x)] for x in chosen_list]
-    if max_choices:
-        selected_pots = selected_pots[: int(max_choices)]
+    selected_pots = [view.potential_by_label[x] for x in chosen_list]
+    if view.max_choices:
+        selected_pots = selected_pots[: view.max_choices]
     st.session_state.answers[qid] = {"selected": selected_pots}
 
-elif qtype == "text":
+elif view.kind == "text":
     default_text = prev.get("text", "") if isinstance(prev, dict) else ""
     txt = st.text_area("Введите ответ:", value=default_text, key=key)
     st.session_state.answers[qid] = {"text": txt}
@@ -251,7 +224,7 @@ else:
 
 
 # optional note/comment
-if q.get("text_field", False):
+if view.text_field:
     prev_note = ""
     if isinstance(prev, dict):
         prev_note = prev.get("note", "")
@@ -260,42 +233,71 @@ if q.get("text_field", False):
     if isinstance(st.session_state.answers[qid], dict):
         st.session_state.answers[qid]["note"] = note
 
+neo_metrics.observe("wizard.render", time.perf_counter() - _t_render)
+
+# применяем (или снимаем при возврате назад) вклад только этого вопроса
+st.session_state.scorer.set_answer(qid, st.session_state.answers.get(qid))
+
+# следующий шаг: по порядку или первый вопрос, который ещё может изменить матрицу
+if ADAPTIVE:
+    _visited = {questionnaire.views[i].qid for i in st.session_state.path} | {qid}
+    _next_qid = st.session_state.scorer.next_question(
+        [v.qid for v in questionnaire.views], _visited, reorder=(ADAPTIVE == "reorder")
+    )
+    next_idx = next((i for i, v in enumerate(questionnaire.views) if v.qid == _next_qid), None) if _next_qid else None
+else:
+    next_idx = idx + 1 if idx < total - 1 else None
+
+# промежуточная матрица — только для мастера, респонденту не показываем
+if st.session_state.get("is_master", False):
+    with st.expander("Промежуточная матрица (видно только мастеру)", expanded=False):
+        pot_names = blocks_data.get("potentials") if isinstance(blocks_data.get("potentials"), dict) else {}
+        partial = st.session_state.scorer.matrix()
+        for col in COLUMNS:
+            cells = []
+            for row in ("row1", "row2", "row3"):
+                pid = partial[col][row]
+                meta = pot_names.get(pid) if pid else None
+                cells.append((meta.get("ru") if isinstance(meta, dict) else None) or pid or "—")
+            st.write(f"**{col}:** " + " / ".join(cells))
+        st.caption(f"Учтено ответов: {st.session_state.scorer.answered()} из {len(questions)}")
+
 
 st.divider()
 
 c1, c2, c3 = st.columns([1, 2, 1])
 
+client_id = st.session_state.respondent["client_id"]
+
 with c1:
-    if st.button("← Назад", use_container_width=True, disabled=(idx == 0)):
-        st.session_state.step = max(0, idx - 1)
+    can_back = bool(st.session_state.path) if ADAPTIVE else idx > 0
+    if st.button("← Назад", use_container_width=True, disabled=not can_back):
+        st.session_state.step = st.session_state.path.pop() if ADAPTIVE else idx - 1
+        sessions.record_answer(client_id, qid, st.session_state.answers.get(qid), st.session_state.step)
         st.rerun()
 
 with c2:
-    is_last = (idx == total - 1)
+    is_last = next_idx is None
     next_label = "Завершить ✅" if is_last else "Далее →"
     if st.button(next_label, use_container_width=True):
+        # каждый переход — одна маленькая запись в хранилище сессий
         if not is_last:
-            st.session_state.step = min(total - 1, idx + 1)
+            if ADAPTIVE:
+                st.session_state.path.append(idx)
+            st.session_state.step = next_idx
+            sessions.record_answer(client_id, qid, st.session_state.answers.get(qid), st.session_state.step)
             st.rerun()
         else:
-            # FINISH: save + score
-            client_id = st.session_state.respondent["client_id"]
-            client_dir = os.path.join(CLIENTS_DIR, client_id)
-            responses_path = os.path.join(client_dir, "responses.json")
-            report_path = os.path.join(client_dir, "report.json")
-
-            payload = {
-                "respondent": st.session_state.respondent,
-                "respondent_id": client_id,
-                "answers": st.session_state.answers,
-            }
-            save_json(responses_path, payload)
-
-            report = score_blocks(blocks_data, payload)
-            save_json(report_path, report)
+            # FINISH: сессия -> responses.json, отчёт — в очередь
+            sessions.record_answer(client_id, qid, st.session_state.answers.get(qid), idx)
+            sessions.finish(client_id, st.session_state.respondent)
+            enqueue_report(client_id)
+            neo_queue.kick()
 
             st.success("Готово! Результаты сохранены ✅")
             st.caption("Теперь они должны появиться в Master Panel в списке клиентов.")
+            del st.query_params["client"]
+            del st.query_params["token"]
             st.stop()
 
 with c3:
@@ -0,0 +1,42 @@
+# test_import.py
+"""
+Битая строка партнёрского файла — ошибка этой строки, а не всего импорта.
+
+    python -m pytest -q test_import.py
+"""
+from __future__ import annotations
+
+import json
+
+from neo_import import RecordError, iter_records
+
+
+def _kinds(records):
+    return [(lineno, isinstance(rec, RecordError)) for lineno, rec in records]
+
+
+def test_jsonl_invalid_utf8_line_is_skipped(tmp_path):
+    good = json.dumps({"respondent_id": "r1", "answers": {"q1": "amber"}}, ensure_ascii=False).encode("utf-8")
+    path = tmp_path / "answers.jsonl"
+    path.write_bytes(b"\xef\xbb\xbf" + good + b"\n" + b'{"respondent_id": "r\xff"}\n' + good + b"\n")
+
+    records = list(iter_records(str(path)))
+    assert _kinds(records) == [(1, False), (2, True), (3, False)]
+    assert "UTF-8" in str(records[1][1])
+    assert records[0][1]["respondent_id"] == "r1"
+
+
+def test_csv_malformed_and_invalid_utf8_rows_are_skipped(tmp_path):
+    path = tmp_path / "answers.csv"
+    path.write_bytes(
+        b"respondent_id,name,q1\r\n"
+        b"r1,\xd0\x90\xd0\xbd\xd0\xbd\xd0\xb0,amber\r\n"
+        b"r2,bro\rken,amber\r\n"  # голый \r посреди поля — csv.Error
+        b"r3,\xff,amber\r\n"  # не UTF-8
+        b"r4,Olga,amber|citrine\r\n"
+    )
+
+    records = list(iter_records(str(path)))
+    assert _kinds(records) == [(2, False), (3, True), (4, True), (5, False)]
+    assert records[0][1]["name"] == "Анна"
+    assert records[3][1]["answers"] == {"q1": ["amber", "citrine"]}
@@ -0,0 +1,36 @@
+# test_items.py
+"""
+Item analysis: знак дискриминации одинаково читается у обычных и штрафных вопросов.
+
+    python -m pytest -q test_items.py
+"""
+from __future__ import annotations
+
+import copy
+import json
+import os
+
+from neo_bench import synthetic_answers
+from neo_items import ItemStats
+from neo_questionnaire import load_questionnaire
+from neo_scoring import _all_questions
+
+BLOCKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "neo_blocks.json")
+
+
+def test_inverted_question_discrimination_is_flipped(tmp_path):
+    blocks = copy.deepcopy(load_questionnaire(BLOCKS).blocks)
+    inverted = _all_questions(blocks)[0]
+    inverted["invert_score"] = True
+    inverted["invert_multiplier"] = 3
+    path = tmp_path / "neo_blocks.json"
+    path.write_text(json.dumps(blocks, ensure_ascii=False), encoding="utf-8")
+
+    q = load_questionnaire(str(path))
+    stats = ItemStats(q)
+    stats.update(list(synthetic_answers(q.compiled, 3000)))
+    item = stats.result()["items"][inverted["id"]]
+
+    # выбор в штрафном вопросе уводит потенциал из row1 — после разворота знака это > 0
+    assert item["invert"] is True
+    assert item["discrimination"] > 0
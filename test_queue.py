@@ -0,0 +1,38 @@
+# test_queue.py
+"""
+Очередь отчётов: задача закрывается вместе со статусом клиента.
+
+    python -m pytest -q test_queue.py
+"""
+from __future__ import annotations
+
+import os
+
+import pytest
+
+import neo_queue
+import neo_storage
+from neo_questionnaire import load_questionnaire
+
+BLOCKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "neo_blocks.json")
+
+
+@pytest.fixture
+def client(data_dir):
+    q = load_questionnaire(BLOCKS)
+    cid = "test-queue"
+    profile = {"client_id": cid, "name": "Тест", "phone": "", "created_at": 1}
+    neo_storage.upsert_client(profile)
+    neo_storage.write_responses(cid, profile, {q.compiled.items[0].qid: "amber"})
+    return cid, q
+
+
+def test_job_for_current_report_marks_client_done(client):
+    cid, q = client
+    neo_storage.ensure_report(cid, q)  # отчёт уже актуален, например после neo_rescore
+    neo_storage.enqueue_report(cid)
+    assert neo_storage.get_client(cid)["report_status"] == neo_storage.REPORT_PENDING
+
+    assert neo_queue.run_once(blocks_path=BLOCKS) == 1
+    assert neo_storage.get_client(cid)["report_status"] == neo_storage.REPORT_DONE
+    assert neo_storage.count_jobs() == 0
@@ -0,0 +1,44 @@
+# test_scoring.py
+"""
+Скалярный, пошаговый и пакетный скоринг должны совпадать побитово.
+
+    python -m pytest -q test_scoring.py
+"""
+from __future__ import annotations
+
+import copy
+import os
+
+import pytest
+
+from neo_bench import check
+from neo_questionnaire import load_questionnaire
+from neo_scoring import _all_questions, compile_questionnaire, score_blocks, score_many
+
+BLOCKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "neo_blocks.json")
+
+
+def test_scoring_paths_agree_on_odd_weights_and_repeats():
+    assert check(load_questionnaire(BLOCKS).blocks, n=500) == []
+
+
+@pytest.mark.parametrize("tokens", [["amber", "amber"], ["amber", "opt_amber", "Янтарь"]])
+def test_repeated_tokens_with_weight_0_1(tokens):
+    blocks = copy.deepcopy(load_questionnaire(BLOCKS).blocks)
+    for q in _all_questions(blocks):
+        q["weight"] = 0.1
+    compiled = compile_questionnaire(blocks)
+
+    # в каждом вопросе amber выбран несколько раз
+    answers = {"answers": {item.qid: tokens for item in compiled.items}}
+    expected = score_blocks(compiled, answers)
+    assert score_many(compiled, [answers]) == [expected]
+
+
+def test_free_text_is_not_scored():
+    compiled = load_questionnaire(BLOCKS).compiled
+    item = compiled.items[0]
+    plain = score_blocks(compiled, {"answers": {item.qid: {"selected": ["amber"]}}})
+    # комментарий с именем потенциала не добавляет ни amber, ни citrine
+    for note in ("Янтарь", "цитрин"):
+        assert score_blocks(compiled, {"answers": {item.qid: {"selected": ["amber"], "note": note}}}) == plain
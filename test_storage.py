@@ -0,0 +1,29 @@
+# test_storage.py
+"""
+Индекс клиентов: инкрементальные читатели не теряют изменений.
+
+    python -m pytest -q test_storage.py
+"""
+from __future__ import annotations
+
+import time
+
+import neo_storage
+
+
+def _done(client_id: str):
+    neo_storage.upsert_client({"client_id": client_id, "name": client_id, "created_at": 1}, neo_storage.REPORT_DONE)
+
+
+def test_changed_since_follows_commit_order_not_clock(data_dir, monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: 200.0)
+    _done("b")
+    watermark = max(seq for _, seq in neo_storage.changed_since(0))
+
+    # второй писатель взял время раньше, а закоммитил позже читателя
+    monkeypatch.setattr(time, "time", lambda: 100.0)
+    _done("a")
+    assert [cid for cid, _ in neo_storage.changed_since(watermark)] == ["a"]
+
+    neo_storage.set_report_status("b", neo_storage.REPORT_DONE)
+    assert [cid for cid, _ in neo_storage.changed_since(watermark)] == ["a", "b"]